@@ -0,0 +1,120 @@
+# On-disk cache of region feature matrices
+#
+# A feature matrix is stored as <key>.npy, where key hashes the region
+# bounds, the settings of every feature (bucket count, scheme, edges,
+# min/max, file) and the digests of the files the features read. Any
+# change to any of them gives a new key, so entries are never stale.
+# Entries are evicted least recently used first once the cache grows past
+# its size cap.
+
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+from irl3.checkpoint import config_hash
+
+DEFAULT_CACHE_DIR = "feature_cache"
+DEFAULT_MAX_BYTES = 512 * 2**20
+# digests of the source files, keyed by their path, size and mtime
+DIGESTS_FILE = "digests.json"
+
+
+def file_digest(filename, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the sha1 of the contents of filename. Digests are remembered
+    in the cache directory until the file's size or mtime changes, so a
+    large raster is only hashed once"""
+
+    stat = os.stat(filename)
+    path = os.path.abspath(filename)
+    index_file = os.path.join(cache_dir, DIGESTS_FILE)
+    try:
+        with open(index_file, "r") as file:
+            digests = json.load(file)
+    except (IOError, ValueError):
+        digests = {}
+    entry = digests.get(path)
+    if entry is not None and entry["size"] == stat.st_size and \
+            entry["mtime"] == stat.st_mtime:
+        return entry["sha1"]
+
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha1.update(block)
+    digests[path] = {"size": stat.st_size, "mtime": stat.st_mtime,
+                     "sha1": sha1.hexdigest()}
+    tmp = index_file + ".tmp"
+    with open(tmp, "w") as file:
+        json.dump(digests, file)
+    os.replace(tmp, index_file)
+    return digests[path]["sha1"]
+
+
+def matrix_key(model, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the cache key of the model's feature matrix, or None if a
+    feature has a custom function and cannot be cached"""
+
+    features = []
+    for name, feature in model.feature_dict.items():
+        if feature.custom_func is not None:
+            return None
+        source = feature.file if feature.stack is None else feature.stack
+        edges = None if feature.scheme == "linear" else \
+            feature.get_edges().tolist()
+        features.append({"name": name,
+                         "buckets": feature.buckets,
+                         "scheme": feature.scheme,
+                         "edges": edges,
+                         "max": feature.max,
+                         "min": feature.min,
+                         "file": feature.file,
+                         "stack": feature.stack,
+                         "digest": file_digest(source, cache_dir)})
+    region = [model.x_start, model.x_end, model.y_start, model.y_end]
+    return config_hash({"region": region, "features": features})
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    """Deletes the least recently used matrices of the cache until they
+    take at most max_bytes, never deleting the file keep"""
+
+    entries = [(os.path.getmtime(path), os.path.getsize(path), path)
+               for path in glob.glob(os.path.join(cache_dir, "*.npy"))]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
+
+
+def get_feature_matrix(model, cache_dir=DEFAULT_CACHE_DIR,
+                       max_bytes=DEFAULT_MAX_BYTES):
+    """Returns model.get_feature_matrix(), from the cache when the region
+    and its features have not changed since it was last built"""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = matrix_key(model, cache_dir)
+    if key is None:
+        return model.get_feature_matrix()
+
+    path = os.path.join(cache_dir, key + ".npy")
+    try:
+        feature_matrix = np.load(path)
+        # the mtime of an entry is its last use
+        os.utime(path)
+        print(f"Loaded cached feature matrix {path}")
+        return feature_matrix
+    except (IOError, ValueError):
+        pass
+
+    feature_matrix = model.get_feature_matrix()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as file:
+        np.save(file, feature_matrix)
+    os.replace(tmp, path)
+    evict(cache_dir, max_bytes, keep=path)
+    return feature_matrix
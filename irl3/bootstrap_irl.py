@@ -0,0 +1,89 @@
+'''
+Bootstrap uncertainty of MaxEnt IRL reward maps
+
+The demonstrations (whole birds, never single steps) are resampled with
+replacement and a reward map is fitted to every resample. The fits are
+split over worker processes, each stepping its share in lockstep with
+maxent_irl_batch. The features, dynamics and trajectory arrays are set
+once per worker by the pool initializer; with fork they are inherited from
+the parent and never copied.
+
+MIT License
+'''
+import multiprocessing
+import numpy as np
+from .maxent_irl import maxent_irl_batch
+from .utils import *
+
+# set in every worker by init_worker
+_shared = {}
+
+
+def bootstrap_samples(n_trajs, n_boot, seed=0):
+  """
+  returns
+    n_boot x n_trajs int array - the trajectories of every resample, drawn
+    with replacement
+  """
+  return np.random.RandomState(seed).randint(n_trajs, size=(n_boot, n_trajs))
+
+
+def init_worker(shared):
+  """
+  pool initializer, keeps the arrays shared by every fit of the worker
+  """
+  _shared.update(shared)
+
+
+def fit_resamples(job):
+  """
+  fit the resamples of one worker
+
+  inputs:
+    job     (seed, samples) - seed of the initial weights and the
+            K x n_trajs trajectories of each resample
+  returns
+    NxK matrix - the rewards of every resample
+  """
+  seed, samples = job
+  np.random.seed(seed)
+  trajs = [subset_trajs(_shared['trajs'], idx) for idx in samples]
+  return maxent_irl_batch(_shared['feat_map'], _shared['P_a'], _shared['gamma'], trajs,
+                          **_shared['kwargs'])
+
+
+def bootstrap_maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters, n_boot=50, processes=None,
+                         seed=0, error=0.01, optimizer='gd', max_horizon=None):
+  """
+  bootstrap mean and standard deviation of the MaxEnt IRL reward map
+
+  inputs:
+    feat_map    NxD matrix - the features for each state
+    P_a         NxNxN_ACTIONS transition dynamics
+    gamma       float - RL discount factor
+    trajs       a list of demonstrations (list of list of Steps or TrajArrays)
+    lr          float - learning rate
+    n_iters     int - number of optimization steps of every fit
+    n_boot      int - number of resamples
+    processes   int - number of worker processes (one per core if None)
+    seed        int - seed of the resamples and the initial weights
+    error, optimizer, max_horizon   as in maxent_irl.maxent_irl_batch
+
+  returns
+    mean        Nx1 vector - per state mean of the normalized rewards
+    std         Nx1 vector - per state standard deviation
+    rewards     Nxn_boot matrix - the rewards of every resample
+  """
+  trajs = flatten_trajs(trajs)
+  samples = bootstrap_samples(len(trajs.offsets) - 1, n_boot, seed)
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  processes = max(min(processes, n_boot), 1)
+  jobs = [(seed + i, chunk) for i, chunk in enumerate(np.array_split(samples, processes))]
+
+  shared = {'feat_map': feat_map, 'P_a': P_a, 'gamma': gamma, 'trajs': trajs,
+            'kwargs': {'lr': lr, 'n_iters': n_iters, 'error': error,
+                       'optimizer': optimizer, 'max_horizon': max_horizon}}
+  with multiprocessing.Pool(processes, initializer=init_worker, initargs=(shared,)) as pool:
+    rewards = np.concatenate(pool.map(fit_resamples, jobs), axis=1)
+  return np.mean(rewards, axis=1), np.std(rewards, axis=1), rewards
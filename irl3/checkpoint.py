@@ -0,0 +1,85 @@
+'''
+Checkpoints for long IRL runs
+
+A checkpoint is one compressed npz holding the parameters, the number of
+finished iterations, the last value function (to warm start the planner),
+the optimizer state, numpy's global RNG state and a hash of the run's
+configuration. Restoring all of it makes a resumed run continue exactly
+where the interrupted one stopped.
+
+MIT License
+'''
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def config_hash(config):
+  """
+  returns
+    hex digest identifying a json serializable configuration
+  """
+  return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def save_checkpoint(path, config, iteration, **arrays):
+  """
+  write a checkpoint, replacing path atomically so an interrupted save
+  never leaves a broken file behind
+
+  inputs:
+    path        str - checkpoint file
+    config      str - config_hash of the run (None if unchecked)
+    iteration   int - number of finished iterations
+    arrays      arrays to store (None values are skipped)
+  """
+  state = np.random.get_state()
+  arrays = dict((k, v) for k, v in arrays.items() if v is not None)
+  # an object array of None could not be loaded back without pickle
+  arrays.update(config_hash='' if config is None else config, iteration=iteration,
+                rng_keys=state[1], rng_pos=state[2], rng_has_gauss=state[3],
+                rng_gauss=state[4])
+  tmp = path + '.tmp'
+  with open(tmp, 'wb') as f:
+    np.savez_compressed(f, **arrays)
+  os.replace(tmp, path)
+
+
+def load_checkpoint(path, config=None):
+  """
+  read a checkpoint and restore numpy's global RNG state from it
+
+  inputs:
+    path        str - checkpoint file
+    config      str - config_hash of the run, checked against the
+                      checkpoint's unless None
+  returns
+    dict of the stored arrays, 'iteration' an int
+  """
+  with np.load(path) as data:
+    ckpt = dict((k, data[k]) for k in data.files)
+  if config is not None and str(ckpt['config_hash']) != config:
+    raise ValueError("checkpoint {} was written with a different configuration".format(path))
+  np.random.set_state(('MT19937', ckpt['rng_keys'], int(ckpt['rng_pos']),
+                       int(ckpt['rng_has_gauss']), float(ckpt['rng_gauss'])))
+  ckpt['iteration'] = int(ckpt['iteration'])
+  return ckpt
+
+
+def optimizer_state(opt, prefix='opt_'):
+  """
+  returns
+    dict of the optimizer's attributes (step size, update count, moments)
+    keyed with prefix, to be saved with save_checkpoint
+  """
+  return dict((prefix + k, v) for k, v in vars(opt).items() if v is not None)
+
+
+def load_optimizer_state(opt, ckpt, prefix='opt_'):
+  """
+  restore the attributes saved by optimizer_state into opt
+  """
+  for key, value in ckpt.items():
+    if key.startswith(prefix):
+      setattr(opt, key[len(prefix):], value.item() if value.ndim == 0 else value)
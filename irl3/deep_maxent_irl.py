@@ -1,9 +1,10 @@
 import numpy as np
-import tensorflow as tf
 from .mdp import gridworld
-from .mdp import value_iteration
-from . import tf_utils
+from .mdp.planners import get_planner
+from .optimizers import get_optimizer
+from .checkpoint import save_checkpoint, load_checkpoint, optimizer_state, load_optimizer_state
 from .utils import *
+from .maxent_irl import compute_state_visition_freq
 
 
 
@@ -11,6 +12,8 @@ class DeepIRLFC:
 
 
   def __init__(self, n_input, lr, n_h1=400, n_h2=300, l2=10, name='deep_irl_fc'):
+    # tensorflow takes seconds to import, so only load it for this backend
+    import tensorflow as tf
     self.n_input = n_input
     self.lr = lr
     self.n_h1 = n_h1
@@ -36,6 +39,8 @@ class DeepIRLFC:
 
 
   def _build_network(self, name):
+    import tensorflow as tf
+    from . import tf_utils
     input_s = tf.placeholder(tf.float32, [None, self.n_input])
     with tf.variable_scope(name):
       fc1 = tf_utils.fc(input_s, self.n_h1, scope="fc1", activation_fn=tf.nn.elu,
@@ -51,6 +56,10 @@ class DeepIRLFC:
     return self.sess.run(self.theta)
 
 
+  def set_theta(self, weights):
+    self.sess.run([v.assign(w) for v, w in zip(self.theta, weights)])
+
+
   def get_rewards(self, states):
     rewards = self.sess.run(self.reward, feed_dict={self.input_s: states})
     return rewards
@@ -65,58 +74,124 @@ class DeepIRLFC:
 
 
 
-def compute_state_visition_freq(P_a, gamma, trajs, policy, deterministic=True):
-  """compute the expected states visition frequency p(s| theta, T)
-  using dynamic programming
+class NumpyDeepIRLFC:
+  """
+  the DeepIRLFC reward network (two elu layers and a linear output, L2
+  penalty, gradients clipped by global norm 100) with manual backprop in
+  numpy - no tensorflow import or session
+  """
 
-  inputs:
-    P_a     NxNxN_ACTIONS matrix - transition dynamics
-    gamma   float - discount factor
-    trajs   list of list of Steps - collected from expert
-    policy  Nx1 vector (or NxN_ACTIONS if deterministic=False) - policy
+
+  def __init__(self, n_input, lr, n_h1=400, n_h2=300, l2=10, optimizer='gd'):
+    """
+    input:
+      optimizer   str - 'gd' (plain gradient descent, as DeepIRLFC) or 'adam'
+    """
+    self.n_input = n_input
+    self.lr = lr
+    self.n_h1 = n_h1
+    self.n_h2 = n_h2
+    self.l2 = l2
+    self.optimizer = get_optimizer(optimizer, lr)
+    if self.optimizer.exact_gradient:
+      raise ValueError("the reward network needs a stochastic optimizer ('gd' or 'adam'), got {}".format(optimizer))
+
+    # same initializers as DeepIRLFC: variance scaling (fan in, truncated
+    # normal) for the hidden layers, standard normal for the output layer
+    shapes = [(n_input, n_h1), (n_h1,), (n_h1, n_h2), (n_h2,), (n_h2, 1), (1,)]
+    self.params = np.zeros(sum(int(np.prod(shape)) for shape in shapes))
+    self.theta = []
+    start = 0
+    for shape in shapes:
+      size = int(np.prod(shape))
+      # views into params, so the optimizer can update everything at once
+      self.theta.append(self.params[start:start + size].reshape(shape))
+      start += size
+    self.theta[0][:] = truncated_normal((n_input, n_h1), np.sqrt(1.3*2/n_input))
+    self.theta[2][:] = truncated_normal((n_h1, n_h2), np.sqrt(1.3*2/n_h1))
+    self.theta[4][:] = np.random.normal(size=(n_h2, 1))
+    self.theta[5][:] = np.random.normal(size=1)
+
+
+  def _forward(self, states):
+    W1, b1, W2, b2, W3, b3 = self.theta
+    z1 = np.dot(states, W1) + b1
+    h1 = elu(z1)
+    z2 = np.dot(h1, W2) + b2
+    h2 = elu(z2)
+    return z1, h1, z2, h2, np.dot(h2, W3) + b3
 
 
-  returns:
-    p       Nx1 vector - state visitation frequencies
-  """
-  N_STATES, _, N_ACTIONS = np.shape(P_a)
+  def get_theta(self):
+    return [np.copy(v) for v in self.theta]
 
-  T = len(trajs[0])
-  # mu[s, t] is the prob of visiting state s at time t
-  mu = np.zeros([N_STATES, T])
 
-  for traj in trajs:
-    mu[traj[0].cur_state, 0] += 1
-  mu[:,0] = mu[:,0]/len(trajs)
+  def set_theta(self, weights):
+    self.params[:] = np.concatenate([np.ravel(w) for w in weights])
 
-  for s in range(N_STATES):
-    for t in range(T-1):
-      if deterministic:
-        mu[s, t+1] = sum([mu[pre_s, t]*P_a[pre_s, s, int(policy[pre_s])] for pre_s in range(N_STATES)])
-      else:
-        mu[s, t+1] = sum([sum([mu[pre_s, t]*P_a[pre_s, s, a1]*policy[pre_s, a1] for a1 in range(N_ACTIONS)]) for pre_s in range(N_STATES)])
-  p = np.sum(mu, 1)
-  return p
 
+  def get_rewards(self, states):
+    return self._forward(np.reshape(states, [-1, self.n_input]))[-1]
 
-def demo_svf(trajs, n_states):
-  """
-  compute state visitation frequences from demonstrations
 
-  input:
-    trajs   list of list of Steps - collected from expert
-  returns:
-    p       Nx1 vector - state visitation frequences
+  def apply_grads(self, feat_map, grad_r):
+    grad_r = np.reshape(grad_r, [-1, 1])
+    feat_map = np.reshape(feat_map, [-1, self.n_input])
+    W1, b1, W2, b2, W3, b3 = self.theta
+    z1, h1, z2, h2, _ = self._forward(feat_map)
+
+    # backprop the loss -grad_r.reward
+    d_out = -grad_r
+    d_z2 = np.dot(d_out, W3.T)*elu_grad(z2)
+    d_z1 = np.dot(d_z2, W2.T)*elu_grad(z1)
+    grad_theta = [np.dot(feat_map.T, d_z1), np.sum(d_z1, axis=0),
+                  np.dot(h1.T, d_z2), np.sum(d_z2, axis=0),
+                  np.dot(h2.T, d_out), np.sum(d_out, axis=0)]
+
+    # apply l2 loss gradients
+    l2_loss = sum(0.5*np.sum(v**2) for v in self.theta)
+    grad_theta = [g + self.l2*v for g, v in zip(grad_theta, self.theta)]
+    # clip by global norm
+    grad_norms = np.sqrt(sum(np.sum(g**2) for g in grad_theta))
+    if grad_norms > 100.0:
+      grad_theta = [g*100.0/grad_norms for g in grad_theta]
+      grad_norms = 100.0
+
+    # the optimizers ascend, so step along the negative loss gradient
+    grad = np.concatenate([np.ravel(g) for g in grad_theta])
+    self.params[:] = self.optimizer.step(self.params, -grad, None, None)
+    self.optimizer.n_updates += 1
+    return grad_theta, l2_loss, grad_norms
+
+
+
+def elu(x):
+  return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+
+def elu_grad(x):
+  return np.where(x > 0, 1.0, np.exp(np.minimum(x, 0)))
+
+
+def truncated_normal(shape, stddev):
+  """
+  normal samples redrawn until they fall within two standard deviations
   """
+  out = np.random.normal(scale=stddev, size=shape)
+  bad = np.abs(out) > 2*stddev
+  while np.any(bad):
+    out[bad] = np.random.normal(scale=stddev, size=np.sum(bad))
+    bad = np.abs(out) > 2*stddev
+  return out
+
+
+BACKENDS = {'tf': DeepIRLFC, 'numpy': NumpyDeepIRLFC}
 
-  p = np.zeros(n_states)
-  for traj in trajs:
-    for step in traj:
-      p[step.cur_state] += 1
-  p = p/len(trajs)
-  return p
 
-def deep_maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters):
+
+def deep_maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters, planner='vi', max_horizon=None,
+                    backend='tf', optimizer='gd', checkpoint_file=None, checkpoint_every=10,
+                    resume=False, config=None):
   """
   Maximum Entropy Inverse Reinforcement Learning (Maxent IRL)
 
@@ -125,10 +200,22 @@ def deep_maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters):
     P_a         NxNxN_ACTIONS matrix - P_a[s0, s1, a] is the transition prob of
                                        landing at state s1 when taking action
                                        a at state s0
+                                       (dense array or SparseTransitions)
     gamma       float - RL discount factor
-    trajs       a list of demonstrations
+    trajs       a list of demonstrations (list of list of Steps or TrajArrays)
     lr          float - learning rate
     n_iters     int - number of optimization steps
+    planner     str - 'vi' (value iteration), 'multigrid' (coarse-to-fine
+                      value iteration, needs StencilTransitions) or 'pi'
+                      (policy iteration with sparse linear solves)
+    max_horizon int - only use the first max_horizon steps of each
+                      demonstration (all of them if None)
+    backend     str - 'tf' (DeepIRLFC) or 'numpy' (NumpyDeepIRLFC, no
+                      tensorflow needed)
+    optimizer   str - 'gd' or 'adam', for the numpy backend
+    checkpoint_file, checkpoint_every, resume, config
+                as in maxent_irl.maxent_irl, the checkpoints hold the
+                network weights
 
   returns
     rewards     Nx1 vector - recoverred state rewards
@@ -136,24 +223,49 @@ def deep_maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters):
 
   # tf.set_random_seed(1)
 
-  N_STATES, _, N_ACTIONS = np.shape(P_a)
+  N_STATES, _, N_ACTIONS = P_a.shape
+
+  plan = get_planner(planner)
+  trajs = truncate_trajs(trajs, max_horizon)
 
   # init nn model
-  nn_r = DeepIRLFC(feat_map.shape[1], lr, 3, 3)
+  if backend not in BACKENDS:
+    raise ValueError("Unknown backend {}, expected one of {}".format(backend, sorted(BACKENDS)))
+  if backend == 'numpy':
+    nn_r = NumpyDeepIRLFC(feat_map.shape[1], lr, 3, 3, optimizer=optimizer)
+  else:
+    nn_r = DeepIRLFC(feat_map.shape[1], lr, 3, 3)
 
   # find state visitation frequencies using demonstrations
   mu_D = demo_svf(trajs, N_STATES)
 
+  # the network only sees the distinct feature rows, and the reward
+  # gradients of the states sharing a row are summed
+  feat_rows, inverse = unique_rows(feat_map)
+
   # training
-  for iteration in range(n_iters):
+  values = None
+  start = 0
+  if resume:
+    print("# resume from {}".format(checkpoint_file))
+    ckpt = load_checkpoint(checkpoint_file, config)
+    start = ckpt['iteration']
+    values = ckpt.get('values')
+    nn_r.set_theta([ckpt['weight_{}'.format(i)] for i in range(len(nn_r.get_theta()))])
+    if backend == 'numpy':
+      load_optimizer_state(nn_r.optimizer, ckpt)
+
+  for iteration in range(start, n_iters):
     if iteration % (n_iters/10) == 0:
       print('iteration: {}'.format(iteration))
 
     # compute the reward matrix
-    rewards = nn_r.get_rewards(feat_map)
+    rewards = nn_r.get_rewards(feat_rows)[inverse]
 
-    # compute policy
-    _, policy = value_iteration.value_iteration(P_a, rewards, gamma, error=0.01, deterministic=True)
+    # compute policy, warm started from the previous iteration
+    values, policy, sweeps = plan(P_a, rewards, gamma, error=0.01, deterministic=True,
+                                  init_values=values, return_sweeps=True)
+    print('iteration: {} value iteration sweeps: {}'.format(iteration, sweeps))
 
     # compute expected svf
     mu_exp = compute_state_visition_freq(P_a, gamma, trajs, policy, deterministic=True)
@@ -162,9 +274,17 @@ def deep_maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters):
     grad_r = mu_D - mu_exp
 
     # apply gradients to the neural network
-    grad_theta, l2_loss, grad_norm = nn_r.apply_grads(feat_map, grad_r)
+    grad_theta, l2_loss, grad_norm = nn_r.apply_grads(feat_rows,
+                                                      sum_by_row(inverse, grad_r, len(feat_rows)))
+
+    if checkpoint_file is not None and checkpoint_every and \
+       (iteration + 1) % checkpoint_every == 0:
+      weights = dict(('weight_{}'.format(i), w) for i, w in enumerate(nn_r.get_theta()))
+      if backend == 'numpy':
+        weights.update(optimizer_state(nn_r.optimizer))
+      save_checkpoint(checkpoint_file, config, iteration + 1, values=values, **weights)
 
 
-  rewards = nn_r.get_rewards(feat_map)
+  rewards = nn_r.get_rewards(feat_rows)[inverse]
   # return sigmoid(normalize(rewards))
   return normalize(rewards)
@@ -0,0 +1,123 @@
+'''
+Joint maximum entropy IRL over several regions with one shared theta
+
+Every region (its own features, dynamics and demonstrations) lives in a
+worker process for the whole fit. Workers keep their planner warm starts
+between steps and only send back the D dimensional gradient, and the
+optimizer follows the sum of the region gradients.
+
+MIT License
+'''
+import multiprocessing
+import traceback
+import numpy as np
+from .mdp.planners import get_planner
+from .maxent_irl import maxent_gradient
+from .optimizers import get_optimizer
+from .utils import *
+
+
+def region_worker(conn, feat_map, P_a, trajs, gamma, error, planner, max_horizon):
+  """
+  serve gradient requests for one region until theta is None
+
+  every request is (theta, exact, need_ll), answered with (ll, grad), or
+  with ('error', traceback) if the evaluation raised
+  """
+  plan = get_planner(planner)
+  trajs = truncate_trajs(trajs, max_horizon)
+  feat_rows, inverse = unique_rows(feat_map)
+  feat_exp = feat_rows.T.dot(sum_by_row(inverse, demo_svf(trajs, feat_map.shape[0]),
+                                        len(feat_rows)))
+  values = None
+  while True:
+    request = conn.recv()
+    if request is None:
+      break
+    theta, exact, need_ll = request
+    try:
+      ll, grad, new_values = maxent_gradient(feat_rows, P_a, gamma, trajs, feat_exp, theta,
+                                             plan, error=error, exact=exact,
+                                             need_ll=need_ll, init_values=values,
+                                             inverse=inverse)
+    except Exception:
+      conn.send(('error', traceback.format_exc()))
+      continue
+    if new_values is not None:
+      values = new_values
+    conn.send((ll, grad))
+  conn.close()
+
+
+def joint_maxent_irl(regions, gamma, lr, n_iters, error=0.01, planner='vi', optimizer='gd',
+                     grad_tol=None, ll_tol=None, max_horizon=None):
+  """
+  Maximum Entropy IRL of one reward weight vector shared by several regions
+
+  inputs:
+    regions     list of (feat_map, P_a, trajs) - per region NxD features
+                (same D everywhere), transition dynamics and demonstrations
+    gamma       float - RL discount factor
+    lr          float - learning rate
+    n_iters     int - maximum number of optimization steps
+    error, planner, optimizer, grad_tol, ll_tol, max_horizon
+                as in maxent_irl.maxent_irl
+
+  returns
+    theta       Dx1 vector - the shared reward weights
+    rewards     list of Nx1 vectors - recovered rewards of every region
+  """
+  n_features = regions[0][0].shape[1]
+  opt = get_optimizer(optimizer, lr)
+
+  # one process per region, each with its own end of a pipe
+  workers = []
+  for feat_map, P_a, trajs in regions:
+    parent_conn, child_conn = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=region_worker,
+                                   args=(child_conn, feat_map, P_a, flatten_trajs(trajs),
+                                         gamma, error, planner, max_horizon))
+    proc.daemon = True
+    proc.start()
+    child_conn.close()
+    workers.append((proc, parent_conn))
+
+  cache = {'theta': None}
+
+  def evaluate(theta):
+    if cache['theta'] is not None and np.array_equal(theta, cache['theta']):
+      return cache['ll'], cache['grad']
+    # send to every region first so that they all work at once
+    for _, conn in workers:
+      conn.send((theta, opt.exact_gradient, ll_tol is not None))
+    replies = [conn.recv() for _, conn in workers]
+    for reply in replies:
+      if isinstance(reply[0], str) and reply[0] == 'error':
+        raise RuntimeError("region worker failed:\n{}".format(reply[1]))
+    lls = [ll for ll, _ in replies]
+    ll = None if any(l is None for l in lls) else sum(lls)
+    grad = np.sum([grad for _, grad in replies], axis=0)
+    cache.update(theta=np.copy(theta), ll=ll, grad=grad)
+    return ll, grad
+
+  def report(iteration, theta, ll, grad):
+    if iteration % max(n_iters//20, 1) == 0:
+      print('iteration: {}/{} |grad|: {:.4f}'.format(iteration, n_iters, np.linalg.norm(grad)))
+      if ll is not None:
+        print('log-likelihood: {:.4f}'.format(ll))
+
+  # init parameters
+  theta = np.random.uniform(size=(n_features,))
+  try:
+    theta = opt.run(evaluate, theta, n_iters, grad_tol=grad_tol, ll_tol=ll_tol, callback=report)
+  finally:
+    for proc, conn in workers:
+      try:
+        conn.send(None)
+      except (BrokenPipeError, EOFError):
+        pass
+      conn.close()
+      proc.join()
+
+  rewards = [normalize(np.dot(feat_map, theta)) for feat_map, _, _ in regions]
+  return theta, rewards
@@ -6,13 +6,93 @@ Implementation of linear programming inverse reinforcement learning in
 By Yiren Lu (luyirenmax@gmail.com), May 2017
 '''
 import numpy as np
-from cvxopt import matrix, solvers
+from scipy import sparse
+from scipy.sparse.linalg import splu
+from cvxopt import matrix, spmatrix, solvers
 from utils import *
 
+
+def action_mats(trans_probs):
+  """
+  returns
+    list of N_ACTIONS NxN sparse matrices of dense, SparseTransitions or
+    StencilTransitions dynamics
+  """
+  if isinstance(trans_probs, np.ndarray):
+    return [sparse.csr_matrix(trans_probs[:, :, a]) for a in range(trans_probs.shape[2])]
+  if hasattr(trans_probs, 'to_sparse'):
+    trans_probs = trans_probs.to_sparse()
+  return [trans_probs.action_mat(a) for a in range(trans_probs.shape[2])]
+
+
+def lp_constraints(trans_probs, policy, gamma=0.5, l1=10, R_max=10):
+  """
+  the linear program of lp_irl - minimize c.x subject to A.x <= b over
+  x = [rewards, min margins t, l1 bounds u]
+
+  (I - gamma*P_a_opt)^-1 only depends on the optimal action, so the system
+  is factored once per distinct action of the policy and every constraint
+  row is one sparse solve against that factorization.
+
+  inputs:
+    same as lp_irl
+  returns
+    A       2N(N_ACTIONS+1) x 3N scipy sparse matrix
+    b       2N(N_ACTIONS+1) vector
+    c       3N vector
+  """
+  mats = action_mats(trans_probs)
+  N_STATES = mats[0].shape[0]
+  N_ACTIONS = len(mats)
+  policy = np.asarray(policy).astype(int)
+  n_cmp = N_STATES * (N_ACTIONS - 1)
+  eye = sparse.identity(N_STATES, format='csc')
+
+  rows, cols, vals = [], [], []
+  for a_opt in np.unique(policy):
+    states = np.nonzero(policy == a_opt)[0]
+    # d.(I - gamma*P)^-1 for all the rows d at once is a solve with the transpose
+    lu = splu(sparse.csc_matrix((eye - gamma * mats[a_opt]).T))
+    for a in range(N_ACTIONS):
+      if a == a_opt:
+        continue
+      # the actions other than a_opt are numbered in order for each state
+      cmp_rows = states * (N_ACTIONS - 1) + (a if a < a_opt else a - 1)
+      diff = (mats[a_opt][states] - mats[a][states]).T.toarray()
+      margins = -lu.solve(diff).T
+      r, s = np.nonzero(margins)
+      for offset in [0, n_cmp]:
+        rows.append(cmp_rows[r] + offset)
+        cols.append(s)
+        vals.append(margins[r, s])
+  idx = np.arange(N_STATES)
+  ones = np.ones(N_STATES)
+  base = 2 * n_cmp
+  # t_i is at most the smallest margin of state i, R <= R_max, -R <= 0 and
+  # R - u <= 0 (twice, as in the dense formulation)
+  rows += [n_cmp + np.arange(n_cmp), base + idx, base + N_STATES + idx,
+           base + 2 * N_STATES + idx, base + 2 * N_STATES + idx,
+           base + 3 * N_STATES + idx, base + 3 * N_STATES + idx]
+  cols += [N_STATES + np.repeat(idx, N_ACTIONS - 1), idx, idx,
+           idx, 2 * N_STATES + idx, idx, 2 * N_STATES + idx]
+  vals += [np.ones(n_cmp), ones, -ones, ones, -ones, ones, -ones]
+
+  n_rows = 2 * N_STATES * (N_ACTIONS + 1)
+  A = sparse.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                        shape=(n_rows, 3 * N_STATES))
+  b = np.zeros([n_rows])
+  b[base:base + N_STATES] = R_max
+  c = np.zeros([3 * N_STATES])
+  c[N_STATES:2 * N_STATES] = -1
+  c[2 * N_STATES:] = l1
+  return A, b, c
+
+
 def lp_irl(trans_probs, policy, gamma=0.5, l1=10, R_max=10):
   """
   inputs:
-    trans_probs       NxNxN_ACTIONS transition matrix
+    trans_probs       NxNxN_ACTIONS transition matrix (dense array,
+                      SparseTransitions or StencilTransitions)
     policy            policy vector / map
     R_max             maximum possible value of recoverred rewards
     gamma             RL discount factor
@@ -21,50 +101,14 @@ def lp_irl(trans_probs, policy, gamma=0.5, l1=10, R_max=10):
     rewards           Nx1 reward vector
   """
   print(np.shape(trans_probs))
-  N_STATES, _, N_ACTIONS = np.shape(trans_probs)
-  N_STATES = int(N_STATES)
-  N_ACTIONS = int(N_ACTIONS)
+  N_STATES = int(np.shape(trans_probs)[0])
 
   # Formulate a linear IRL problem
-  A = np.zeros([2 * N_STATES * (N_ACTIONS + 1), 3 * N_STATES])
-  b = np.zeros([2 * N_STATES * (N_ACTIONS + 1)])
-  c = np.zeros([3 * N_STATES])
-
-  for i in range(N_STATES):
-    a_opt = int(policy[i])
-    tmp_inv = np.linalg.inv(np.identity(N_STATES) - gamma * trans_probs[:, :, a_opt])
-
-    cnt = 0
-    for a in range(N_ACTIONS):
-      if a != a_opt:
-        A[i * (N_ACTIONS - 1) + cnt, :N_STATES] = - \
-            np.dot(trans_probs[i, :, a_opt] - trans_probs[i, :, a], tmp_inv)
-        A[N_STATES * (N_ACTIONS - 1) + i * (N_ACTIONS - 1) + cnt, :N_STATES] = - \
-            np.dot(trans_probs[i, :, a_opt] - trans_probs[i, :, a], tmp_inv)
-        A[N_STATES * (N_ACTIONS - 1) + i * (N_ACTIONS - 1) + cnt, N_STATES + i] = 1
-        cnt += 1
-
-  for i in range(N_STATES):
-    A[2 * N_STATES * (N_ACTIONS - 1) + i, i] = 1
-    b[2 * N_STATES * (N_ACTIONS - 1) + i] = R_max
-
-  for i in range(N_STATES):
-    A[2 * N_STATES * (N_ACTIONS - 1) + N_STATES + i, i] = -1
-    b[2 * N_STATES * (N_ACTIONS - 1) + N_STATES + i] = 0
-
-  for i in range(N_STATES):
-    A[2 * N_STATES * (N_ACTIONS - 1) + 2 * N_STATES + i, i] = 1
-    A[2 * N_STATES * (N_ACTIONS - 1) + 2 * N_STATES + i, 2 * N_STATES + i] = -1
-
-  for i in range(N_STATES):
-    A[2 * N_STATES * (N_ACTIONS - 1) + 3 * N_STATES + i, i] = 1
-    A[2 * N_STATES * (N_ACTIONS - 1) + 3 * N_STATES + i, 2 * N_STATES + i] = -1
-
-  for i in range(N_STATES):
-    c[N_STATES:2 * N_STATES] = -1
-    c[2 * N_STATES:] = l1
+  A, b, c = lp_constraints(trans_probs, policy, gamma, l1, R_max)
 
-  sol = solvers.lp(matrix(c), matrix(A), matrix(b))
+  # cvxopt's sparse interface keeps the identity blocks sparse
+  A = spmatrix(A.data.tolist(), A.row.tolist(), A.col.tolist(), size=A.shape)
+  sol = solvers.lp(matrix(c), A, matrix(b))
   rewards = sol['x'][:N_STATES]
   rewards = normalize(rewards) * R_max
   return rewards
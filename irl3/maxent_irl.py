@@ -10,47 +10,260 @@ Acknowledgement:
 By Yiren Lu (luyirenmax@gmail.com), May 2017
 '''
 import numpy as np
+from scipy.special import logsumexp
 from .mdp import gridworld
 from .mdp import value_iteration
+from .mdp.planners import get_planner
+from .mdp.transitions import log_expected_next, propagate
+from .optimizers import get_optimizer
+from .checkpoint import save_checkpoint, load_checkpoint, optimizer_state, load_optimizer_state
 from .utils import *
 
 
-def compute_state_visition_freq(P_a, gamma, trajs, policy, deterministic=True):
+def start_schedule(trajs, n_states, max_horizon=None, mass_tol=0):
+  """
+  when to inject the start states of variable length demonstrations into a
+  forward pass. Trajectories are aligned to end together, so one of length
+  L starts at step T - L and all of them share a single pass of T steps.
+
+  inputs:
+    trajs       TrajArrays - collected from expert
+    n_states    int - number of states
+    max_horizon int - longer trajectories only count their first max_horizon
+                      steps (no limit if None)
+    mass_tol    float - also drop the tail of the longest trajectories while
+                        the visitation mass it holds stays below mass_tol
+
+  returns:
+    T           int - number of steps of the forward pass
+    inject      dict - step t to the Nx1 start state mass injected at t,
+                       per trajectory
+  """
+  n_trajs = len(trajs.offsets) - 1
+  lengths = np.diff(trajs.offsets)
+  starts = trajs.states[trajs.offsets[:-1][lengths > 0]]
+  lengths = lengths[lengths > 0]
+  if max_horizon is not None:
+    lengths = np.minimum(lengths, max_horizon)
+  if len(lengths) == 0:
+    return 0, {}
+
+  # active[t] is the fraction of trajectories still going at step t. The
+  # forward pass keeps the mass of a trajectory, so cutting every trajectory
+  # at T drops exactly sum(active[T:]) of visitation mass.
+  active = np.cumsum(np.bincount(lengths)[::-1])[::-1][1:]/n_trajs
+  tail = np.cumsum(active[::-1])[::-1]
+  T = len(active) - np.sum(tail <= mass_tol)
+  lengths = np.minimum(lengths, T)
+
+  inject = {}
+  for t in np.unique(T - lengths):
+    inject[t] = np.bincount(starts[lengths == T - t], minlength=n_states)/n_trajs
+  return T, inject
+
+
+def compute_state_visition_freq(P_a, gamma, trajs, policy, deterministic=True,
+                                max_horizon=None, mass_tol=1e-6):
   """compute the expected states visition frequency p(s| theta, T)
   using dynamic programming
 
+  Each trajectory contributes as many steps as it has, so datasets mixing
+  short and long demonstrations are weighted correctly.
+
   inputs:
-    P_a     NxNxN_ACTIONS matrix - transition dynamics
+    P_a     NxNxN_ACTIONS matrix - transition dynamics (dense, SparseTransitions
+            or StencilTransitions)
     gamma   float - discount factor
-    trajs   list of list of Steps - collected from expert
+    trajs   list of list of Steps or TrajArrays - collected from expert
     policy  Nx1 vector (or NxN_ACTIONS if deterministic=False) - policy
+    max_horizon   int - count at most this many steps per trajectory
+    mass_tol      float - skip the last steps of the longest trajectories
+                          while they hold less visitation mass than this
 
 
   returns:
     p       Nx1 vector - state visitation frequencies
   """
-  N_STATES, _, N_ACTIONS = np.shape(P_a)
-
-  T = len(trajs[0])
-  # mu[s, t] is the prob of visiting state s at time t
-  mu = np.zeros([N_STATES, T])
-
-  for traj in trajs:
-    mu[traj[0].cur_state, 0] += 1
-  mu[:,0] = mu[:,0]/len(trajs)
-
-  for s in range(N_STATES):
-    for t in range(T-1):
-      if deterministic:
-        mu[s, t+1] = sum([mu[pre_s, t]*P_a[pre_s, s, int(policy[pre_s])] for pre_s in range(N_STATES)])
-      else:
-        mu[s, t+1] = sum([sum([mu[pre_s, t]*P_a[pre_s, s, a1]*policy[pre_s, a1] for a1 in range(N_ACTIONS)]) for pre_s in range(N_STATES)])
-  p = np.sum(mu, 1)
+  N_STATES, _, N_ACTIONS = P_a.shape
+
+  trajs = flatten_trajs(trajs)
+  T, inject = start_schedule(trajs, N_STATES, max_horizon, mass_tol)
+
+  # pi[s, a] is the prob of taking action a at state s
+  if deterministic:
+    pi = np.zeros([N_STATES, N_ACTIONS])
+    pi[np.arange(N_STATES), np.asarray(policy, dtype=int).ravel()] = 1
+  else:
+    pi = np.asarray(policy)
+
+  # mu is the prob of visiting each state at the current time step, summed
+  # over the trajectories that have started
+  mu = np.zeros([N_STATES])
+  p = np.zeros([N_STATES])
+  for t in range(T):
+    if t > 0:
+      mu = propagate(P_a, pi*mu[:, None])
+    if t in inject:
+      mu = mu + inject[t]
+    p += mu
+  return p
+
+
+def compute_state_visition_freq_batch(P_a, trajs, policy, max_horizon=None, mass_tol=1e-6):
+  """
+  compute_state_visition_freq for K datasets and K stochastic policies on
+  the same dynamics in one forward pass
+
+  The pass is the same at every step, so a dataset whose own pass is
+  shorter than the longest one is simply injected later.
+
+  inputs:
+    P_a     NxNxN_ACTIONS transition dynamics
+    trajs   list of K TrajArrays (or lists of list of Steps)
+    policy  NxN_ACTIONSxK - stochastic policy of each dataset
+    max_horizon, mass_tol   as in compute_state_visition_freq
+
+  returns:
+    p       NxK matrix - state visitation frequencies of each dataset
+  """
+  N_STATES = P_a.shape[0]
+  K = len(trajs)
+  schedules = [start_schedule(flatten_trajs(t), N_STATES, max_horizon, mass_tol) for t in trajs]
+  T = max([T_k for T_k, _ in schedules] + [0])
+  inject = {}
+  for k, (T_k, inject_k) in enumerate(schedules):
+    for t, mass in inject_k.items():
+      inject.setdefault(t + T - T_k, np.zeros([N_STATES, K]))[:, k] = mass
+
+  pi = np.asarray(policy)
+  mu = np.zeros([N_STATES, K])
+  p = np.zeros([N_STATES, K])
+  for t in range(T):
+    if t > 0:
+      mu = propagate(P_a, pi*mu[:, None, :])
+    if t in inject:
+      mu = mu + inject[t]
+    p += mu
   return p
 
 
+def maxent_log_likelihood(P_a, rewards, trajs, max_horizon=None, mass_tol=1e-6):
+  """
+  log-likelihood of the demonstrations under the MaxEnt trajectory
+  distribution P(traj) ~ exp(sum_t rewards[s_t]), and the expected state
+  visitation frequencies under that distribution (the backward and forward
+  passes of Ziebart et al. 2008, Algorithm 1, in log space).
+
+  With rewards = feat_map.theta the gradient of ll with respect to theta is
+  exactly feat_exp - feat_map.T.svf, so the pair can drive a line search.
+
+  inputs:
+    P_a     NxNxN_ACTIONS transition dynamics
+    rewards Nx1 vector - state rewards
+    trajs   list of list of Steps or TrajArrays - collected from expert
+    max_horizon   int - count at most this many steps per trajectory
+    mass_tol      float - see compute_state_visition_freq
+
+  returns:
+    ll      float - log-likelihood per demonstration, up to the dynamics
+                    terms that do not depend on the rewards
+    svf     Nx1 vector - expected state visitation frequencies
+  """
+  N_STATES, _, N_ACTIONS = P_a.shape
+  trajs = flatten_trajs(trajs)
+  T, inject = start_schedule(trajs, N_STATES, max_horizon, mass_tol)
+  rewards = np.reshape(rewards, [-1])
+
+  # backward pass - V[t] is the soft value of being at each state at step t,
+  # with T - t steps to go. A trajectory injected at t starts from V[t].
+  V = np.zeros([T, N_STATES])
+  if T > 0:
+    V[T-1] = rewards
+  for t in range(T-2, -1, -1):
+    # log sum_s1 P_a[s, s1, a]*exp(V[t+1, s1]), stabilized row by row so a
+    # state far below the largest value cannot underflow to log(0)
+    V[t] = rewards + logsumexp(log_expected_next(P_a, V[t+1]), axis=1)
+
+  ll = np.dot(rewards, demo_svf(truncate_trajs(trajs, T), N_STATES))
+  for t in inject:
+    ll -= np.dot(inject[t], V[t])
+
+  # forward pass - given (s, a) the next state s1 is drawn with prob
+  # proportional to P_a[s, s1, a]*exp(V[t+1, s1]), so all actions share one
+  # propagation. v_max keeps both exponents bounded.
+  mu = np.zeros([N_STATES])
+  p = np.zeros([N_STATES])
+  for t in range(T):
+    if t > 0:
+      v_max = np.max(V[t])
+      with np.errstate(invalid='ignore'):
+        w = np.nan_to_num(mu*np.exp(rewards + v_max - V[t-1]))
+      mu = propagate(P_a, np.repeat(w[:, None], N_ACTIONS, axis=1))*np.exp(V[t] - v_max)
+    if t in inject:
+      mu = mu + inject[t]
+    p += mu
+  return ll, p
+
 
-def maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters, error=0.01):
+def maxent_gradient(feat_map, P_a, gamma, trajs, feat_exp, theta, plan,
+                    error=0.01, exact=False, need_ll=False, init_values=None, inverse=None):
+  """
+  one evaluation of the MaxEnt objective at theta
+
+  inputs:
+    feat_map    NxD matrix - the features for each state (UxD unique rows
+                             if inverse is given)
+    P_a         NxNxN_ACTIONS transition dynamics
+    gamma       float - RL discount factor
+    trajs       TrajArrays - demonstrations
+    feat_exp    Dx1 vector - feature expectations of trajs
+    theta       Dx1 vector - reward weights
+    plan        planner function (see mdp.planners)
+    error       float - value iteration stopping threshold
+    exact       bool - take the svf from the MaxEnt backward pass, whose
+                       gradient is exact, instead of the planner's policy
+    need_ll     bool - also compute the log-likelihood when not exact
+    init_values Nx1 vector - values to warm start the planner from
+    inverse     N int array - state s has the features feat_map[inverse[s]]
+                (see utils.unique_rows)
+
+  returns
+    ll          float - log-likelihood of trajs (None if not computed)
+    grad        Dx1 vector - feat_exp - feat_map.T.svf
+    values      Nx1 vector - the planner's values (None if exact)
+  """
+  print("# compute reward function")
+  rewards = np.dot(feat_map, theta)
+  if inverse is not None:
+    rewards = rewards[inverse]
+
+  ll = None
+  values = None
+  if exact:
+    print("# compute log-likelihood and state visition frequences")
+    ll, svf = maxent_log_likelihood(P_a, rewards, trajs)
+  else:
+    print("# compute policy")
+    values, policy, sweeps = plan(P_a, rewards, gamma, error=error, deterministic=False,
+                                  init_values=init_values, return_sweeps=True)
+    print("# value iteration sweeps: {}".format(sweeps))
+
+    print("# compute state visition frequences")
+    svf = compute_state_visition_freq(P_a, gamma, trajs, policy, deterministic=False)
+    if need_ll:
+      ll, _ = maxent_log_likelihood(P_a, rewards, trajs)
+
+  print("# compute gradients")
+  if inverse is not None:
+    svf = sum_by_row(inverse, svf, feat_map.shape[0])
+  grad = feat_exp - feat_map.T.dot(svf)
+  return ll, grad, values
+
+
+def maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters, error=0.01, planner='vi',
+               optimizer='gd', grad_tol=None, ll_tol=None, max_horizon=None,
+               batch_size=None, lr_decay=0, checkpoint_file=None, checkpoint_every=10,
+               resume=False, config=None, return_theta=False):
   """
   Maximum Entropy Inverse Reinforcement Learning (Maxent IRL)
 
@@ -59,48 +272,199 @@ def maxent_irl(feat_map, P_a, gamma, trajs, lr, n_iters, error=0.01):
     P_a         NxNxN_ACTIONS matrix - P_a[s0, s1, a] is the transition prob of
                                        landing at state s1 when taking action
                                        a at state s0
+                                       (dense array or SparseTransitions)
     gamma       float - RL discount factor
-    trajs       a list of demonstrations
-    lr          float - learning rate
-    n_iters     int - number of optimization steps
+    trajs       a list of demonstrations (list of list of Steps or TrajArrays)
+    lr          float - learning rate (initial step for 'linesearch')
+    n_iters     int - maximum number of optimization steps
+    error       float - value iteration stopping threshold
+    planner     str - 'vi' (value iteration), 'multigrid' (coarse-to-fine
+                      value iteration, needs StencilTransitions) or 'pi'
+                      (policy iteration with sparse linear solves)
+    optimizer   str - 'gd' (fixed step gradient ascent), 'adam',
+                      'linesearch' (backtracking line search) or 'lbfgs'.
+                      'linesearch' and 'lbfgs' take the svf from the MaxEnt
+                      backward pass instead of the planner's policy
+    grad_tol    float - stop once the gradient norm falls below it
+    ll_tol      float - stop once the demonstrations' log-likelihood changes
+                        by less than it between iterations
+    max_horizon int - only use the first max_horizon steps of each
+                      demonstration (all of them if None)
+    batch_size  int - if set, every gradient step uses a random mini-batch
+                      of batch_size demonstrations and the feature
+                      expectations are a running mean over the batches seen
+                      ('gd' and 'adam' only)
+    lr_decay    float - the learning rate at step t is lr/(1 + lr_decay*t)
+    checkpoint_file   str - save a checkpoint there every checkpoint_every
+                            iterations (see irl3.checkpoint)
+    checkpoint_every  int - iterations between checkpoints (0 or None for none)
+    resume      bool - continue from checkpoint_file instead of starting over
+    config      str - config_hash of the run, stored in the checkpoints and
+                      checked when resuming
+    return_theta  bool - also return the learned reward weights
 
   returns
     rewards     Nx1 vector - recoverred state rewards
+    theta       Dx1 vector - reward weights (only if return_theta)
   """
-  N_STATES, _, N_ACTIONS = np.shape(P_a)
+  N_STATES, _, N_ACTIONS = P_a.shape
+  plan = get_planner(planner)
+  if lr_decay:
+    opt = get_optimizer(optimizer, lr, lr_decay=lr_decay)
+  else:
+    opt = get_optimizer(optimizer, lr)
+  if batch_size is not None and opt.exact_gradient:
+    raise ValueError("mini-batches need a stochastic optimizer ('gd' or 'adam'), got {}".format(optimizer))
 
   # init parameters
   theta = np.random.uniform(size=(feat_map.shape[1],))
 
+  # states share few distinct feature rows, so rewards and gradients are
+  # computed on those
+  feat_rows, inverse = unique_rows(feat_map)
+
+  def feature_counts(svf):
+    return feat_rows.T.dot(sum_by_row(inverse, svf, len(feat_rows)))
+
   # calc feature expectations
-  feat_exp = np.zeros([feat_map.shape[1]])
-  for episode in trajs:
-    for step in episode:
-      feat_exp += feat_map[step.cur_state,:]
-  feat_exp = feat_exp/len(trajs)
+  trajs = truncate_trajs(trajs, max_horizon)
+  n_trajs = len(trajs.offsets) - 1
+  if batch_size is None:
+    feat_exp = feature_counts(demo_svf(trajs, N_STATES))
+  else:
+    batch_size = min(batch_size, n_trajs)
+    # running mean of the feature expectations of the batches seen so far
+    running = {'feat_exp': np.zeros(feat_map.shape[1]), 'n_batches': 0}
 
-  # training
-  for iteration in range(n_iters):
+  # the line search and L-BFGS compare log-likelihoods along the gradient, so
+  # they need the exact gradient of the MaxEnt backward pass. The planner is
+  # warm started from the previous solve, and the last evaluation is kept
+  # for optimizers that revisit a point.
+  cache = {'theta': None, 'values': None}
 
-    if iteration % (n_iters/20) == 0:
-      print('iteration: {}/{}'.format(iteration, n_iters))
+  def evaluate(theta):
+    if cache['theta'] is not None and np.array_equal(theta, cache['theta']):
+      return cache['ll'], cache['grad']
 
-    print("# compute reward function")
-    rewards = np.dot(feat_map, theta)
+    if batch_size is None:
+      batch, batch_feat_exp = trajs, feat_exp
+    else:
+      print("# sample mini-batch")
+      batch = subset_trajs(trajs, np.random.choice(n_trajs, batch_size, replace=False))
+      running['n_batches'] += 1
+      running['feat_exp'] += (feature_counts(demo_svf(batch, N_STATES))
+                              - running['feat_exp'])/running['n_batches']
+      batch_feat_exp = running['feat_exp']
 
-    print("# compute policy")
-    _, policy = value_iteration.value_iteration(P_a, rewards, gamma,
-                                                error=error, deterministic=False)
+    ll, grad, values = maxent_gradient(feat_rows, P_a, gamma, batch, batch_feat_exp, theta, plan,
+                                       error=error, exact=opt.exact_gradient,
+                                       need_ll=ll_tol is not None,
+                                       init_values=cache['values'], inverse=inverse)
+    if values is not None:
+      cache['values'] = values
 
-    print("# compute state visition frequences")
-    svf = compute_state_visition_freq(P_a, gamma, trajs, policy, deterministic=False)
+    if batch_size is None:
+      cache.update(theta=np.copy(theta), ll=ll, grad=grad)
+    return ll, grad
 
-    print("# compute gradients")
-    grad = feat_exp - feat_map.T.dot(svf)
+  def report(iteration, theta, ll, grad):
+    if iteration % max(n_iters//20, 1) == 0:
+      print('iteration: {}/{} |grad|: {:.4f}'.format(iteration, n_iters, np.linalg.norm(grad)))
+      if ll is not None:
+        print('log-likelihood: {:.4f}'.format(ll))
 
-    print("# update params")
-    theta += lr * grad
+  def save(n_done, theta):
+    if checkpoint_file is not None and checkpoint_every and n_done % checkpoint_every == 0:
+      extra = {}
+      if batch_size is not None:
+        extra = {'feat_exp': running['feat_exp'], 'n_batches': running['n_batches']}
+      save_checkpoint(checkpoint_file, config, n_done, theta=theta, values=cache['values'],
+                      **dict(optimizer_state(opt), **extra))
 
-  rewards = np.dot(feat_map, theta)
+  start = 0
+  if resume:
+    print("# resume from {}".format(checkpoint_file))
+    ckpt = load_checkpoint(checkpoint_file, config)
+    start = ckpt['iteration']
+    theta = ckpt['theta']
+    cache['values'] = ckpt.get('values')
+    load_optimizer_state(opt, ckpt)
+    if batch_size is not None:
+      running.update(feat_exp=ckpt['feat_exp'], n_batches=int(ckpt['n_batches']))
+
+  # training
+  theta = opt.run(evaluate, theta, n_iters, grad_tol=grad_tol, ll_tol=ll_tol, callback=report,
+                  start=start, after_step=save)
+
+  rewards = np.dot(feat_rows, theta)[inverse]
   # return sigmoid(normalize(rewards))
+  if return_theta:
+    return normalize(rewards), theta
   return normalize(rewards)
+
+
+def maxent_irl_batch(feat_map, P_a, gamma, trajs, lr, n_iters, error=0.01, optimizer='gd',
+                     max_horizon=None):
+  """
+  K independent MaxEnt IRL fits on the same features and dynamics, one per
+  dataset, stepped in lockstep. Every iteration plans for all K reward
+  vectors with one value_iteration_batch and propagates all K state
+  visitation frequencies in one pass.
+
+  inputs:
+    feat_map    NxD matrix - the features for each state
+    P_a         NxNxN_ACTIONS transition dynamics
+    gamma       float - RL discount factor
+    trajs       list of K demonstration sets (TrajArrays or list of list of
+                Steps)
+    lr          float - learning rate
+    n_iters     int - number of optimization steps
+    error       float - value iteration stopping threshold
+    optimizer   str - 'gd' or 'adam'
+    max_horizon int - only use the first max_horizon steps of each
+                      demonstration (all of them if None)
+
+  returns
+    rewards     NxK matrix - recoverred state rewards of each fit
+  """
+  opt = get_optimizer(optimizer, lr)
+  if opt.exact_gradient:
+    raise ValueError("batched fits need a stochastic optimizer ('gd' or 'adam'), got {}".format(optimizer))
+  trajs = [truncate_trajs(t, max_horizon) for t in trajs]
+  N_STATES = P_a.shape[0]
+  K = len(trajs)
+
+  feat_rows, inverse = unique_rows(feat_map)
+
+  def feature_counts(svf):
+    return feat_rows.T.dot(np.stack([sum_by_row(inverse, svf[:, k], len(feat_rows))
+                                     for k in range(K)], axis=1))
+
+  # calc feature expectations
+  feat_exp = feature_counts(np.stack([demo_svf(t, N_STATES) for t in trajs], axis=1))
+
+  # init parameters, one column per fit
+  theta = np.random.uniform(size=(feat_map.shape[1], K))
+  cache = {'values': None}
+
+  def evaluate(theta):
+    print("# compute policies")
+    rewards = np.dot(feat_rows, theta)[inverse]
+    values, policy = value_iteration.value_iteration_batch(P_a, rewards, gamma, error=error,
+                                                           deterministic=False,
+                                                           init_values=cache['values'])
+    cache['values'] = values
+    print("# compute state visition frequences")
+    svf = compute_state_visition_freq_batch(P_a, trajs, policy)
+    return None, feat_exp - feature_counts(svf)
+
+  def report(iteration, theta, ll, grad):
+    if iteration % max(n_iters//20, 1) == 0:
+      print('iteration: {}/{} mean |grad|: {:.4f}'.format(
+          iteration, n_iters, np.mean(np.linalg.norm(grad, axis=0))))
+
+  # training
+  theta = opt.run(evaluate, theta, n_iters, callback=report)
+
+  rewards = np.dot(feat_rows, theta)[inverse]
+  return np.stack([normalize(rewards[:, k]) for k in range(K)], axis=1)
@@ -7,6 +7,7 @@
 # MIT License
 
 import numpy as np
+from .transitions import SparseTransitions
 
 
 class GridWorld(object):
@@ -299,10 +300,14 @@ class GridWorld(object):
   # Some util functions #
   #######################
 
-  def get_transition_mat(self):
+  def get_transition_mat(self, sparse=False):
     """
     get transition dynamics of the gridworld
 
+    input:
+      sparse      bool - return a SparseTransitions (one CSR matrix per
+                    action) instead of the dense NxNxN_ACTIONS tensor
+
     return:
       P_a         NxNxN_ACTIONS transition probabilities matrix -
                     P_a[s0, s1, a] is the transition prob of
@@ -311,6 +316,19 @@ class GridWorld(object):
     """
     N_STATES = self.height*self.width
     N_ACTIONS = len(self.actions)
+    if sparse:
+      s0, s1, acts, probs = [], [], [], []
+      for si in range(N_STATES):
+        posi = self.idx2pos(si)
+        for a in range(N_ACTIONS):
+          for posj, prob in self.get_transition_states_and_probs(posi, a):
+            s0.append(si)
+            s1.append(self.pos2idx(posj))
+            acts.append(a)
+            probs.append(prob)
+      return SparseTransitions.from_triples(N_STATES, N_ACTIONS, s0, s1, acts, probs,
+                                            grid_shape=(self.height, self.width))
+
     P_a = np.zeros((N_STATES, N_STATES, N_ACTIONS))
     for si in range(N_STATES):
       posi = self.idx2pos(si)
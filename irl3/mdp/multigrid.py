@@ -0,0 +1,125 @@
+# Coarse-to-fine (multigrid) value iteration for grid MDPs
+# With gamma close to 1, value information only moves one cell per sweep,
+# so plain value iteration needs on the order of grid-diameter sweeps. Here
+# the problem is solved on a pyramid of coarsened grids first and the
+# prolongated coarse values are the initial guess for the next finer level,
+# so the full grid only has to fix up local detail.
+#
+# MIT License
+
+import time
+import numpy as np
+from .stencil import StencilTransitions, block_reduce
+from .value_iteration import value_iteration
+
+
+def build_pyramid(P_a, min_size=8):
+  """
+  inputs:
+    P_a         StencilTransitions of the full grid
+    min_size    int - stop coarsening once the grid is this small
+  returns
+    a list of StencilTransitions from the full grid to the coarsest
+  """
+  levels = [P_a]
+  while min(levels[-1].grid_shape) > min_size:
+    levels.append(levels[-1].coarsen())
+  return levels
+
+
+def restrict_rewards(P_a, rewards):
+  """
+  the largest reward of each 2x2 block of the (fine) grid of P_a
+  """
+  grid = np.reshape(rewards, P_a.grid_shape, order='F')
+  coarse = block_reduce(grid.astype(np.float64), np.nanmax, fill=np.nan)
+  return np.reshape(coarse, -1, order='F')
+
+
+def prolong_values(values, coarse_shape, fine_shape):
+  """
+  copy the value of each coarse cell onto its 2x2 block of fine cells
+  """
+  grid = np.reshape(values, coarse_shape, order='F')
+  fine = np.repeat(np.repeat(grid, 2, axis=0), 2, axis=1)[:fine_shape[0], :fine_shape[1]]
+  return np.reshape(fine, -1, order='F')
+
+
+def multigrid_value_iteration(P_a, rewards, gamma, error=0.01, deterministic=True,
+                              init_values=None, return_sweeps=False, min_size=8):
+  """
+  coarse-to-fine value iteration, same inputs and outputs as value_iteration
+
+  A coarse step covers two fine steps, so level l is solved with discount
+  gamma**(2**l) and the reward collected over those steps. Given
+  init_values (e.g. from the previous MaxEnt iteration) the warm start is
+  already a good guess, and only the full grid is solved.
+
+  inputs:
+    P_a         StencilTransitions of the grid
+    rewards     Nx1 matrix - rewards for all the states
+    gamma       float - RL discount
+    error       float - threshold for a stop
+    deterministic   bool - to return deterministic policy or stochastic policy
+    init_values     Nx1 matrix - values to start from, coarse solve if None
+    return_sweeps   bool - also return the number of full grid sweeps
+    min_size    int - size of the coarsest grid
+
+  returns:
+    values    Nx1 matrix - estimated values
+    policy    Nx1 (NxN_ACTIONS if non-det) matrix - policy
+    sweeps    int - number of full grid sweeps (only if return_sweeps)
+  """
+  if not isinstance(P_a, StencilTransitions):
+    raise ValueError("multigrid value iteration needs StencilTransitions")
+
+  rewards = np.reshape(rewards, [-1]).astype(np.float64)
+  if init_values is None:
+    levels = build_pyramid(P_a, min_size)
+    level_rewards = [rewards]
+    for level in levels[:-1]:
+      level_rewards.append(restrict_rewards(level, level_rewards[-1]))
+
+    values = None
+    for l in range(len(levels) - 1, 0, -1):
+      g = gamma**(2**l)
+      # reward of a coarse step - the fine reward collected 2**l times
+      r = level_rewards[l]*np.sum(gamma**np.arange(2**l))
+      values, _ = value_iteration(levels[l], r, g, error=error, init_values=values)
+      values = prolong_values(values, levels[l].grid_shape, levels[l-1].grid_shape)
+    init_values = values
+
+  return value_iteration(P_a, rewards, gamma, error=error, deterministic=deterministic,
+                         init_values=init_values, return_sweeps=return_sweeps)
+
+
+def benchmark(sizes=(51, 101, 201), gamma=0.8, error=0.01):
+  """
+  compare full grid sweeps, wall clock time and distance to the exact
+  values of plain and multigrid value iteration on a sparse reward map
+  (a few rewarding cells)
+  """
+  for size in sizes:
+    P_a = StencilTransitions(size, size)
+    rewards = np.zeros(P_a.shape[0])
+    rewards[np.random.randint(P_a.shape[0], size=3)] = 1
+    values_opt, _ = value_iteration(P_a, rewards, gamma, error=1e-10)
+
+    start = time.time()
+    values, _, sweeps = value_iteration(P_a, rewards, gamma, error=error, return_sweeps=True)
+    vi_time = time.time() - start
+
+    start = time.time()
+    values_mg, _, sweeps_mg = multigrid_value_iteration(P_a, rewards, gamma, error=error,
+                                                        return_sweeps=True)
+    mg_time = time.time() - start
+
+    print('{0}x{0}: vi {1} sweeps {2:.3f}s err {3:.4f}, multigrid {4} sweeps {5:.3f}s '
+          'err {6:.4f}'.format(size, sweeps, vi_time, np.max(np.abs(values - values_opt)),
+                               sweeps_mg, mg_time, np.max(np.abs(values_mg - values_opt))))
+
+
+if __name__ == "__main__":
+  for gamma in [0.8, 0.95, 0.99]:
+    print('gamma = {}'.format(gamma))
+    benchmark(gamma=gamma)
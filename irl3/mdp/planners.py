@@ -0,0 +1,26 @@
+# Planners that solve a grid MDP for its values and policy
+# All planners share the value_iteration signature:
+#   planner(P_a, rewards, gamma, error=0.01, deterministic=True,
+#           init_values=None, return_sweeps=False)
+#
+# MIT License
+
+from .value_iteration import value_iteration
+from .multigrid import multigrid_value_iteration
+from .policy_iteration import policy_iteration
+
+
+PLANNERS = {'vi': value_iteration,
+            'multigrid': multigrid_value_iteration,
+            'pi': policy_iteration}
+
+
+def get_planner(name):
+  """
+  returns
+    the planner function registered under name
+  """
+  try:
+    return PLANNERS[name]
+  except KeyError:
+    raise ValueError("Unknown planner {}, expected one of {}".format(name, sorted(PLANNERS)))
@@ -0,0 +1,114 @@
+# Policy iteration with exact sparse policy evaluation
+# Each evaluation solves (I - gamma*P_pi) v = r_pi with a sparse direct
+# solver, so the cost is a handful of linear solves when the policy
+# settles early instead of dozens of value iteration sweeps.
+#
+# MIT License
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
+from .transitions import SparseTransitions, expected_next
+from .value_iteration import value_iteration, q_values, stochastic_policy
+
+
+def evaluate_policy(P_a, rewards, gamma, policy, row_sums=None):
+  """
+  exact evaluation of a deterministic policy
+
+  inputs:
+    P_a         SparseTransitions
+    rewards     Nx1 matrix - rewards for all the states
+    gamma       float - RL discount
+    policy      Nx1 vector - action taken at each state
+    row_sums    NxN_ACTIONS matrix - sum_s1 P_a[s, s1, a], computed if None
+
+  returns:
+    values      Nx1 vector - solution of (I - gamma*P_pi) v = r_pi, or None
+                if the system is too ill-conditioned to solve reliably
+  """
+  N_STATES = P_a.shape[0]
+  states = np.arange(N_STATES)
+  policy = np.asarray(policy, dtype=int)
+  if row_sums is None:
+    row_sums = expected_next(P_a, np.ones(N_STATES))
+
+  P_pi = P_a.stacked[policy*N_STATES + states]
+  r_pi = row_sums[states, policy]*np.reshape(rewards, [-1])
+  A = (sparse.identity(N_STATES, format='csr') - gamma*P_pi).tocsc()
+  values = splinalg.spsolve(A, r_pi)
+
+  residual = np.max(np.abs(A.dot(values) - r_pi)) if np.all(np.isfinite(values)) else np.inf
+  if residual > 1e-8*(1 + np.max(np.abs(r_pi))):
+    return None
+  return values
+
+
+def policy_iteration(P_a, rewards, gamma, error=0.01, deterministic=True,
+                     init_values=None, return_sweeps=False, max_iters=100):
+  """
+  policy iteration, same inputs and outputs as value_iteration
+
+  Falls back to value_iteration (warm started from the last evaluated
+  values) when a policy evaluation is ill-conditioned, e.g. gamma close to 1.
+
+  inputs:
+    P_a         NxNxN_ACTIONS transition dynamics (dense, SparseTransitions
+                or StencilTransitions)
+    rewards     Nx1 matrix - rewards for all the states
+    gamma       float - RL discount
+    error       float - threshold for a stop of the value iteration fallback
+    deterministic   bool - to return deterministic policy or stochastic policy
+    init_values     Nx1 matrix - values the first policy is greedy to
+    return_sweeps   bool - also return the number of policy evaluations
+    max_iters   int - maximum number of policy improvements
+
+  returns:
+    values    Nx1 matrix - values of the final policy
+    policy    Nx1 (NxN_ACTIONS if non-det) matrix - policy
+    sweeps    int - number of policy evaluations (only if return_sweeps)
+  """
+  if isinstance(P_a, np.ndarray):
+    P_sparse = SparseTransitions.from_dense(P_a)
+  elif isinstance(P_a, SparseTransitions):
+    P_sparse = P_a
+  else:
+    P_sparse = P_a.to_sparse()
+
+  N_STATES = P_sparse.shape[0]
+  rewards = np.reshape(rewards, [-1])
+  row_sums = expected_next(P_sparse, np.ones(N_STATES))
+
+  if init_values is None:
+    values = np.zeros([N_STATES])
+  else:
+    values = np.array(init_values, dtype=np.float64).reshape([N_STATES])
+  policy = np.argmax(q_values(P_sparse, rewards, gamma, values, row_sums), axis=1)
+
+  evals = 0
+  for _ in range(max_iters):
+    new_values = evaluate_policy(P_sparse, rewards, gamma, policy, row_sums)
+    evals += 1
+    if new_values is None:
+      print("Policy evaluation is ill-conditioned, falling back to value iteration")
+      return value_iteration(P_sparse, rewards, gamma, error=error, deterministic=deterministic,
+                             init_values=values, return_sweeps=return_sweeps)
+    values = new_values
+
+    q = q_values(P_sparse, rewards, gamma, values, row_sums)
+    # only switch action on a strict improvement so ties cannot cycle
+    current = q[np.arange(N_STATES), policy]
+    improve = np.max(q, axis=1) > current + 1e-10*(1 + np.abs(current))
+    if not np.any(improve):
+      break
+    policy = np.where(improve, np.argmax(q, axis=1), policy)
+
+  q = q_values(P_sparse, rewards, gamma, values, row_sums)
+  if deterministic:
+    policy = np.argmax(q, axis=1).astype(np.float64)
+  else:
+    policy = stochastic_policy(q)
+
+  if return_sweeps:
+    return values, policy, evals
+  return values, policy
@@ -0,0 +1,310 @@
+# Matrix-free transition dynamics for 4-neighbour-plus-stay grid MDPs
+# Transitions are applied as array shifts on the 2d value grid, so no
+# transition matrix is ever built and memory stays O(N). The dynamics
+# match GridWorld.get_transition_states_and_probs: invalid moves (off the
+# grid or into an 'x' obstacle) stay in place, terminals are absorbing, and
+# trans_prob < 1 spreads the remaining probability over all the moves.
+#
+# MIT License
+
+import numpy as np
+from .transitions import SparseTransitions
+
+
+class StencilTransitions(object):
+  """
+  Stencil based NxNxN_ACTIONS transition dynamics of a grid MDP
+  """
+
+  # right, left, down, up, stay - same order as GridWorld.neighbors
+  neighbors = [(0, 1), (0, -1), (1, 0), (-1, 0), (0, 0)]
+
+  def __init__(self, height, width, obstacles=None, terminals=(), trans_prob=1):
+    """
+    input:
+      height      int - number of rows of the grid
+      width       int - number of columns of the grid
+      obstacles   HxW bool array - True on 'x' cells
+      terminals   HxW bool array or an iterable of (row, col) positions
+      trans_prob  transition probability when given a certain action
+    """
+    self.height = height
+    self.width = width
+    self.grid_shape = (height, width)
+    n_states = height*width
+    n_actions = len(self.neighbors)
+    self.shape = (n_states, n_states, n_actions)
+    self.trans_prob = trans_prob
+
+    if obstacles is None:
+      obstacles = np.zeros(self.grid_shape, dtype=bool)
+    self.obstacles = np.asarray(obstacles, dtype=bool)
+
+    if isinstance(terminals, np.ndarray) and terminals.shape == self.grid_shape:
+      self.terminals = terminals.astype(bool)
+    else:
+      self.terminals = np.zeros(self.grid_shape, dtype=bool)
+      for pos in terminals:
+        if not isinstance(pos, (tuple, list, np.ndarray)) or len(pos) != 2 or \
+           not all(isinstance(i, (int, np.integer)) for i in pos):
+          raise ValueError('terminals must be (row, col) positions, got {}'.format(pos))
+        if not (0 <= pos[0] < height and 0 <= pos[1] < width):
+          raise ValueError('terminal {} is outside the {}x{} grid'.format(pos, height, width))
+        self.terminals[pos[0], pos[1]] = True
+
+    # state s = y + x*height, so a C-order reshape of a state vector gives a
+    # [x, y] grid view without copying. The masks below use that layout.
+    self._terminals = self.terminals.T.copy()
+    # _valid[b] is True where moving along neighbors[b] lands on a free cell
+    self._valid = np.zeros((n_actions, width, height), dtype=bool)
+    free = ~self.obstacles.T
+    for b, inc in enumerate(self.neighbors):
+      self._valid[b] = self._shift(free, inc)
+    self._n_invalid = np.sum(~self._valid[:-1], axis=0)
+
+  @classmethod
+  def from_gridworld(cls, gw):
+    """
+    build the stencil dynamics of a GridWorld
+    """
+    obstacles = np.array(gw.grid, dtype=object) == 'x'
+    return cls(gw.height, gw.width, obstacles, gw.terminals, gw.trans_prob)
+
+  def coarsen(self):
+    """
+    merge 2x2 blocks of cells into one cell of a coarser grid. A coarse cell
+    is an obstacle if all of its fine cells are, and terminal if any is.
+
+    returns
+      the StencilTransitions of the ceil(H/2) x ceil(W/2) grid
+    """
+    obstacles = block_reduce(self.obstacles, np.all, fill=True)
+    terminals = block_reduce(self.terminals, np.any, fill=False)
+    return StencilTransitions(obstacles.shape[0], obstacles.shape[1], obstacles,
+                              terminals, self.trans_prob)
+
+  def _shift(self, grid, inc):
+    """
+    input:
+      grid    [x, y] grid (WxH, WxHxK, ...)
+      inc     (dy, dx) move
+    returns
+      out with out[x, y] = grid[x + dx, y + dy], zero off the grid
+    """
+    dy, dx = inc
+    W, H = grid.shape[:2]
+    out = np.zeros_like(grid)
+    out[max(-dx, 0):W - max(dx, 0), max(-dy, 0):H - max(dy, 0)] = \
+        grid[max(dx, 0):W + min(dx, 0), max(dy, 0):H + min(dy, 0)]
+    return out
+
+  def _move_weights(self, a):
+    """
+    returns
+      w       N_ACTIONS vector - w[b] is the prob of trying move b under action a
+      stay    WxH [x, y] grid - prob of staying in place under action a
+    """
+    n_actions = self.shape[2]
+    if self.trans_prob == 1:
+      w = np.zeros(n_actions)
+      w[a] = 1
+      stay = ~self._valid[a] if a < n_actions - 1 else np.ones((self.width, self.height))
+      return w, stay.astype(np.float64)
+    w = np.full(n_actions, (1 - self.trans_prob)/n_actions)
+    w[a] += self.trans_prob
+    # invalid moves fall back to staying, which is itself lost on obstacles
+    stay = self._valid[-1]*(w[-1] + (1 - self.trans_prob)/n_actions*self._n_invalid
+                            + (self.trans_prob*~self._valid[a] if a < n_actions - 1 else 0))
+    return w, stay
+
+  def _to_grid(self, vec):
+    return np.reshape(vec, (self.width, self.height) + np.shape(vec)[1:])
+
+  def _expand(self, mask, ndim):
+    return np.reshape(mask, mask.shape + (1,)*(ndim - 2))
+
+  def expected_next(self, values):
+    """
+    input:
+      values    N (or NxK) vector of next state values
+    returns
+      NxN_ACTIONS (or NxN_ACTIONSxK) - sum_s1 P_a[s0, s1, a]*values[s1]
+    """
+    V = self._to_grid(values)
+    n_actions = self.shape[2]
+    moved = [self._expand(self._valid[b], V.ndim)*self._shift(V, inc)
+             for b, inc in enumerate(self.neighbors[:-1])]
+    terminals = self._expand(self._terminals, V.ndim)
+
+    out = np.empty((n_actions,) + V.shape)
+    for a in range(n_actions):
+      w, stay = self._move_weights(a)
+      E = self._expand(stay, V.ndim)*V
+      for b in range(n_actions - 1):
+        if w[b] != 0:
+          E += w[b]*moved[b]
+      out[a] = np.where(terminals, V, E)
+    return np.moveaxis(np.reshape(out, (n_actions, self.shape[0]) + V.shape[2:]), 0, 1)
+
+  def log_expected_next(self, values):
+    """
+    input:
+      values    N vector of next state log values
+    returns
+      NxN_ACTIONS - log sum_s1 P_a[s0, s1, a]*exp(values[s1])
+    """
+    V = self._to_grid(values)
+    n_actions = self.shape[2]
+    moved = [np.where(self._valid[b], self._shift(V, inc), -np.inf)
+             for b, inc in enumerate(self.neighbors[:-1])]
+    here = np.where(self._valid[-1], V, -np.inf)
+
+    out = np.empty((n_actions,) + V.shape)
+    if self.trans_prob == 1:
+      # every row has a single successor
+      for a in range(n_actions - 1):
+        out[a] = np.where(self._valid[a], moved[a], V)
+      out[-1] = V
+    else:
+      # every action reaches the same successors (the free neighbours and the
+      # cell itself if free) with nonzero weights, so shifting each cell by
+      # their largest value keeps every row finite
+      shift = np.max(moved + [here], axis=0)
+      shift = np.where(np.isfinite(shift), shift, 0)
+      E = [np.exp(m - shift) for m in moved]
+      E_here = np.exp(here - shift)
+      with np.errstate(divide='ignore'):
+        for a in range(n_actions):
+          w, stay = self._move_weights(a)
+          S = stay*E_here
+          for b in range(n_actions - 1):
+            S += w[b]*E[b]
+          out[a] = np.log(S) + shift
+    out = np.where(self._terminals, V, out)
+    return np.reshape(out, (n_actions, self.shape[0])).T
+
+  def propagate(self, weights):
+    """
+    forward occupancy propagation
+
+    input:
+      weights   NxN_ACTIONS (or NxN_ACTIONSxK) - mass on each (state, action)
+    returns
+      N (or NxK) vector - sum_{s0, a} weights[s0, a]*P_a[s0, s1, a]
+    """
+    n_actions = self.shape[2]
+    Wt = np.reshape(weights, (self.width, self.height) + np.shape(weights)[1:])
+    rest = Wt.shape[3:]
+    ndim = 2 + len(rest)
+    terminals = self._expand(self._terminals, ndim)
+
+    out = np.zeros((self.width, self.height) + rest)
+    moving = np.zeros((n_actions - 1, self.width, self.height) + rest)
+    for a in range(n_actions):
+      mass = np.where(terminals, 0, Wt[:, :, a])
+      w, stay = self._move_weights(a)
+      out += np.where(terminals, Wt[:, :, a], self._expand(stay, ndim)*mass)
+      for b in range(n_actions - 1):
+        if w[b] != 0:
+          moving[b] += w[b]*mass
+    for b, inc in enumerate(self.neighbors[:-1]):
+      # mass leaving (y, x) along inc lands on (y + dy, x + dx)
+      out += self._shift(self._expand(self._valid[b], ndim)*moving[b], (-inc[0], -inc[1]))
+    return np.reshape(out, (self.shape[0],) + rest)
+
+  def successors(self, s, a):
+    """
+    returns
+      (states, probs) - the states reachable from s under action a and
+      their probabilities
+    """
+    y, x = s % self.height, s // self.height
+    if self._terminals[x, y]:
+      return np.array([s]), np.array([1.0])
+    w, stay = self._move_weights(a)
+    states, probs = [], []
+    for b, inc in enumerate(self.neighbors[:-1]):
+      if w[b] != 0 and self._valid[b, x, y]:
+        states.append((y + inc[0]) + (x + inc[1])*self.height)
+        probs.append(w[b])
+    if stay[x, y] != 0:
+      states.append(s)
+      probs.append(stay[x, y])
+    return np.array(states, dtype=int), np.array(probs, dtype=np.float64)
+
+  def to_sparse(self):
+    """
+    returns
+      the equivalent SparseTransitions
+    """
+    H = self.height
+    idx = np.reshape(np.arange(self.shape[0]), (self.width, self.height))
+    free = ~self._terminals
+    s0, s1, acts, probs = [], [], [], []
+    for a in range(self.shape[2]):
+      w, stay = self._move_weights(a)
+      # moves to the neighbours, staying in place, and absorbing terminals
+      for b, inc in enumerate(self.neighbors[:-1]):
+        if w[b] != 0:
+          sel = idx[self._valid[b] & free]
+          s0.append(sel)
+          s1.append(sel + inc[0] + inc[1]*H)
+          probs.append(np.full(len(sel), w[b]))
+          acts.append(np.full(len(sel), a))
+      sel = (stay != 0) & free
+      s0.append(idx[sel])
+      s1.append(idx[sel])
+      probs.append(stay[sel])
+      acts.append(np.full(np.sum(sel), a))
+      s0.append(idx[self._terminals])
+      s1.append(idx[self._terminals])
+      probs.append(np.ones(np.sum(self._terminals)))
+      acts.append(np.full(np.sum(self._terminals), a))
+    return SparseTransitions.from_triples(self.shape[0], self.shape[2], np.concatenate(s0),
+                                          np.concatenate(s1), np.concatenate(acts),
+                                          np.concatenate(probs), grid_shape=self.grid_shape)
+
+
+def trajectory_terminals(trajs, height, width):
+  """
+  the last position on the grid of every trajectory. A trajectory that
+  leaves the grid records the first state outside it as its last next_state
+  (wrapped into a wrong state id when it leaves through the bottom), so its
+  last step's cur_state is used instead
+
+  inputs:
+    trajs       list of list of Steps, states numbered y + x*height
+    height      int - number of rows of the grid
+    width       int - number of columns of the grid
+  returns
+    list of (row, col) positions, one per trajectory
+  """
+  terminals = []
+  for traj in trajs:
+    step = traj[-1]
+    row, col = step.cur_state % height, step.cur_state // height
+    d_row, d_col = StencilTransitions.neighbors[step.action]
+    # the cell the last action moves to, if it is on the grid
+    if 0 <= row + d_row < height and 0 <= col + d_col < width and \
+       step.next_state == (row + d_row) + (col + d_col)*height:
+      row, col = row + d_row, col + d_col
+    terminals.append((int(row), int(col)))
+  return terminals
+
+
+def block_reduce(grid, func, fill):
+  """
+  reduce the 2x2 blocks of a HxW (or HxWxK) grid
+
+  inputs:
+    grid    HxW array
+    func    reduction applied over each block, e.g. np.mean or np.any
+    fill    value used to pad odd sized grids (np.nan for np.nanmean)
+  returns
+    ceil(H/2) x ceil(W/2) array
+  """
+  H, W = grid.shape[:2]
+  pad = [(0, H % 2), (0, W % 2)] + [(0, 0)]*(grid.ndim - 2)
+  padded = np.pad(grid, pad, mode='constant', constant_values=fill)
+  blocks = np.reshape(padded, ((H + 1)//2, 2, (W + 1)//2, 2) + grid.shape[2:])
+  return func(blocks, axis=(1, 3))
@@ -0,0 +1,34 @@
+import unittest
+import numpy as np
+from . import multigrid
+from . import value_iteration
+from .stencil import StencilTransitions
+
+
+class MultigridTest(unittest.TestCase):
+  """
+  Unit test for coarse-to-fine value iteration
+  """
+
+  def setUp(self):
+    obstacles = np.zeros((21, 17), dtype=bool)
+    obstacles[5, 3:12] = True
+    self.P_a = StencilTransitions(21, 17, obstacles, {(20, 16)}, 0.9)
+    self.rewards = np.zeros(self.P_a.shape[0])
+    self.rewards[[3, 100, 250]] = 1
+
+  def test_pyramid(self):
+    levels = multigrid.build_pyramid(self.P_a, min_size=4)
+    self.assertEqual([l.grid_shape for l in levels], [(21, 17), (11, 9), (6, 5), (3, 3)])
+    self.assertTrue(levels[1].terminals[10, 8])
+
+  def test_matches_value_iteration(self):
+    values, policy = value_iteration.value_iteration(self.P_a, self.rewards, 0.95, error=1e-8)
+    values_mg, policy_mg = multigrid.multigrid_value_iteration(self.P_a, self.rewards, 0.95,
+                                                               error=1e-8, min_size=4)
+    self.assertTrue(np.allclose(values, values_mg, atol=1e-5))
+    self.assertTrue(np.array_equal(policy, policy_mg))
+
+
+if __name__ == '__main__':
+  unittest.main()
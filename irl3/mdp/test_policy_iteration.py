@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from . import gridworld
+from . import value_iteration
+from . import policy_iteration
+from .stencil import StencilTransitions
+
+
+class PolicyIterationTest(unittest.TestCase):
+  """
+  Unit test for policy iteration
+  """
+
+  def setUp(self):
+    grid = [['0', '0', '0', '1'],
+            ['0', 'x', '0', '-1'],
+            ['0', '0', '0', '0']]
+
+    self.gw = gridworld.GridWorld(grid, {(0, 3), (1, 3)}, 0.8)
+    self.rewards = np.array([self.gw.get_reward(self.gw.idx2pos(s))
+                             for s in range(self.gw.n_states)])
+
+  def test_matches_value_iteration(self):
+    values, policy = value_iteration.value_iteration(
+        self.gw.get_transition_mat(), self.rewards, 0.9, error=1e-10)
+    for P_a in [self.gw.get_transition_mat(), self.gw.get_transition_mat(sparse=True),
+                StencilTransitions.from_gridworld(self.gw)]:
+      values_pi, policy_pi = policy_iteration.policy_iteration(P_a, self.rewards, 0.9)
+      self.assertTrue(np.allclose(values, values_pi, atol=1e-8))
+      self.assertTrue(np.array_equal(policy, policy_pi))
+
+  def test_evaluate_policy(self):
+    P_a = self.gw.get_transition_mat(sparse=True)
+    policy = np.random.randint(self.gw.n_actions, size=self.gw.n_states)
+    values = policy_iteration.evaluate_policy(P_a, self.rewards, 0.9, policy)
+    q = value_iteration.q_values(P_a, self.rewards, 0.9, values)
+    self.assertTrue(np.allclose(values, q[np.arange(self.gw.n_states), policy]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+from . import gridworld
+from . import value_iteration
+from .stencil import StencilTransitions, trajectory_terminals
+from .transitions import log_expected_next
+from ..utils import Step
+
+
+class StencilTransitionsTest(unittest.TestCase):
+  """
+  Unit test for the matrix-free grid dynamics
+  """
+
+  def setUp(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', 'x', '0']]
+
+    self.gws = [gridworld.GridWorld(grid, {(0, 4), (1, 4)}, 1),
+                gridworld.GridWorld(grid, {(0, 4), (1, 4)}, 0.8)]
+
+  def test_matches_dense(self):
+    for gw in self.gws:
+      P_a = gw.get_transition_mat()
+      stencil = StencilTransitions.from_gridworld(gw)
+      self.assertEqual(stencil.shape, P_a.shape)
+      self.assertTrue(np.allclose(stencil.to_sparse().todense(), P_a))
+
+  def test_expected_next(self):
+    for gw in self.gws:
+      P_a = gw.get_transition_mat()
+      stencil = StencilTransitions.from_gridworld(gw)
+      values = np.random.uniform(size=(gw.n_states, 3))
+      self.assertTrue(np.allclose(stencil.expected_next(values[:, 0]),
+                                  np.tensordot(P_a, values[:, 0], axes=([1], [0]))))
+      self.assertTrue(np.allclose(stencil.expected_next(values),
+                                  np.tensordot(P_a, values, axes=([1], [0]))))
+
+  def test_log_expected_next(self):
+    for gw in self.gws:
+      P_a = gw.get_transition_mat()
+      stencil = StencilTransitions.from_gridworld(gw)
+      values = np.random.uniform(-5, 5, size=gw.n_states)
+      with np.errstate(divide='ignore'):
+        expected = np.log(np.tensordot(P_a, np.exp(values), axes=([1], [0])))
+      for P in [P_a, stencil, stencil.to_sparse()]:
+        self.assertTrue(np.allclose(log_expected_next(P, values), expected))
+      # successors 2000 below the largest value still give finite rows
+      values[0] = 2000
+      log_z = [log_expected_next(P, values) for P in [P_a, stencil, stencil.to_sparse()]]
+      self.assertTrue(np.all(np.isfinite(log_z[0])))
+      self.assertTrue(np.allclose(log_z[0], log_z[1]))
+      self.assertTrue(np.allclose(log_z[0], log_z[2]))
+
+  def test_propagate(self):
+    for gw in self.gws:
+      P_a = gw.get_transition_mat()
+      stencil = StencilTransitions.from_gridworld(gw)
+      weights = np.random.uniform(size=(gw.n_states, gw.n_actions))
+      self.assertTrue(np.allclose(stencil.propagate(weights),
+                                  np.einsum('ik,ijk->j', weights, P_a)))
+
+  def test_value_iteration(self):
+    gw = self.gws[1]
+    rewards = np.array([gw.get_reward(gw.idx2pos(s)) for s in range(gw.n_states)])
+    values_d, policy_d = value_iteration.value_iteration(
+        gw.get_transition_mat(), rewards, 0.8)
+    values_s, policy_s = value_iteration.value_iteration(
+        StencilTransitions.from_gridworld(gw), rewards, 0.8)
+    self.assertTrue(np.allclose(values_d, values_s))
+    self.assertTrue(np.array_equal(policy_d, policy_s))
+
+  def test_bad_terminals(self):
+    # state ids and positions off the grid are rejected, not skipped
+    for terminals in [[14], [(3, 0)], [(0, -1)], [(0, 1, 2)]]:
+      with self.assertRaises(ValueError):
+        StencilTransitions(3, 5, terminals=terminals)
+
+  def test_trajectory_terminals(self):
+    # 3x5 grid, state = row + col*3. The birds end inside the grid, leave
+    # through the right edge and leave through the bottom edge
+    trajs = [[Step(0, 0, 3, 0, False), Step(3, 2, 4, 0, True)],
+             [Step(10, 4, 10, 0, False), Step(13, 0, 16, 0, True)],
+             [Step(4, 2, 5, 0, False), Step(5, 2, 6, 0, True)]]
+    terminals = trajectory_terminals(trajs, 3, 5)
+    self.assertEqual(terminals, [(1, 1), (1, 4), (2, 1)])
+    stencil = StencilTransitions(3, 5, terminals=terminals)
+    self.assertEqual(np.sum(stencil.terminals), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
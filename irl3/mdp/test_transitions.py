@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+from . import gridworld
+from . import value_iteration
+
+
+class SparseTransitionsTest(unittest.TestCase):
+  """
+  Unit test for the sparse transition dynamics
+  """
+
+  def setUp(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', '0', '0']]
+
+    self.gw_deterministic = gridworld.GridWorld(grid, {(0, 4), (1, 4)}, 1)
+    self.gw_non_deterministic = gridworld.GridWorld(
+        grid, {(0, 4), (1, 4)}, 0.8)
+
+  def test_matches_dense(self):
+    for gw in [self.gw_deterministic, self.gw_non_deterministic]:
+      P_dense = gw.get_transition_mat()
+      P_sparse = gw.get_transition_mat(sparse=True)
+      self.assertEqual(P_sparse.shape, P_dense.shape)
+      self.assertTrue(np.allclose(P_sparse.todense(), P_dense))
+
+  def test_rows_sum_to_one(self):
+    gw = self.gw_non_deterministic
+    P_sparse = gw.get_transition_mat(sparse=True)
+    # obstacle cells are never entered, so only check the free states
+    free = [gw.pos2idx(pos) for pos in gw.get_states()]
+    for a in range(P_sparse.shape[2]):
+      row_sums = np.asarray(P_sparse.action_mat(a).sum(axis=1)).ravel()
+      self.assertTrue(np.allclose(row_sums[free], 1))
+
+  def test_value_iteration_matches_dense(self):
+    gw = self.gw_non_deterministic
+    rewards = np.array([gw.get_reward(gw.idx2pos(s)) for s in range(gw.n_states)])
+    values_d, policy_d = value_iteration.value_iteration(
+        gw.get_transition_mat(), rewards, 0.8)
+    values_s, policy_s = value_iteration.value_iteration(
+        gw.get_transition_mat(sparse=True), rewards, 0.8)
+    self.assertTrue(np.allclose(values_d, values_s))
+    self.assertTrue(np.array_equal(policy_d, policy_s))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import sys
+import numpy as np
 # if "../" not in sys.path:
 # sys.path.append("../")
 # from envs import gridworld
@@ -39,5 +40,91 @@ class ValueIterationAgentTest(unittest.TestCase):
     self.gw_non_deterministic.display_value_grid(self.agent.values)
 
 
+class ValueIterationTest(unittest.TestCase):
+  """
+  Unit test for the batched value_iteration function
+  """
+
+  def setUp(self):
+    grid = [['0', '0', '0', '1'],
+            ['0', 'x', '0', '-1'],
+            ['0', '0', '0', '0']]
+
+    self.gw = gridworld.GridWorld(grid, {(0, 3), (1, 3)}, 0.8)
+    self.P_a = self.gw.get_transition_mat()
+    self.rewards = np.array([self.gw.get_reward(self.gw.idx2pos(s))
+                             for s in range(self.gw.n_states)])
+
+  def loop_backup(self, values):
+    N_STATES, _, N_ACTIONS = self.P_a.shape
+    return np.array([[sum([self.P_a[s, s1, a]*(self.rewards[s] + 0.9*values[s1])
+                           for s1 in range(N_STATES)])
+                      for a in range(N_ACTIONS)]
+                     for s in range(N_STATES)])
+
+  def test_q_values(self):
+    values = np.random.uniform(size=self.gw.n_states)
+    q = value_iteration.q_values(self.P_a, self.rewards, 0.9, values)
+    self.assertTrue(np.allclose(q, self.loop_backup(values)))
+
+  def test_fixed_point(self):
+    values, policy = value_iteration.value_iteration(
+        self.P_a, self.rewards, 0.9, error=1e-8)
+    q = self.loop_backup(values)
+    self.assertTrue(np.allclose(values, np.max(q, axis=1), atol=1e-6))
+    self.assertTrue(np.array_equal(policy, np.argmax(q, axis=1)))
+
+  def test_warm_start(self):
+    values, policy, sweeps = value_iteration.value_iteration(
+        self.P_a, self.rewards, 0.9, error=1e-6, return_sweeps=True)
+    values_w, policy_w, sweeps_w = value_iteration.value_iteration(
+        self.P_a, self.rewards, 0.9, error=1e-6, init_values=values, return_sweeps=True)
+    self.assertEqual(sweeps_w, 1)
+    self.assertLess(sweeps_w, sweeps)
+    self.assertTrue(np.allclose(values, values_w, atol=1e-5))
+    self.assertTrue(np.array_equal(policy, policy_w))
+
+  def test_gauss_seidel(self):
+    P_sparse = self.gw.get_transition_mat(sparse=True)
+    values, policy, sweeps = value_iteration.value_iteration(
+        P_sparse, self.rewards, 0.9, error=1e-8, return_sweeps=True)
+    values_gs, policy_gs, sweeps_gs = value_iteration.value_iteration(
+        P_sparse, self.rewards, 0.9, error=1e-8, return_sweeps=True, mode='gauss-seidel')
+    self.assertTrue(np.allclose(values, values_gs, atol=1e-6))
+    self.assertTrue(np.array_equal(policy, policy_gs))
+    self.assertLessEqual(sweeps_gs, sweeps)
+    with self.assertRaises(ValueError):
+      value_iteration.value_iteration(self.P_a, self.rewards, 0.9, mode='gauss-seidel')
+
+  def test_batch(self):
+    rewards = np.random.uniform(size=(self.gw.n_states, 4))
+    for deterministic in [True, False]:
+      values, policy, sweeps = value_iteration.value_iteration_batch(
+          self.P_a, rewards, 0.9, deterministic=deterministic, return_sweeps=True)
+      for k in range(rewards.shape[1]):
+        values_k, policy_k, sweeps_k = value_iteration.value_iteration(
+            self.P_a, rewards[:, k], 0.9, deterministic=deterministic, return_sweeps=True)
+        self.assertTrue(np.allclose(values[:, k], values_k))
+        self.assertTrue(np.allclose(policy[..., k], policy_k))
+        self.assertEqual(sweeps[k], sweeps_k)
+
+  def test_stochastic_policy_shape(self):
+    _, policy = value_iteration.value_iteration(
+        self.P_a, self.rewards, 0.9, deterministic=False)
+    self.assertEqual(policy.shape, (self.gw.n_states, self.gw.n_actions))
+
+  def test_bad_rewards(self):
+    # zero rewards give q = 0, the policy is uniform instead of 0/0
+    _, policy = value_iteration.value_iteration(
+        self.P_a, np.zeros(self.gw.n_states), 0.9, deterministic=False)
+    self.assertTrue(np.allclose(policy, 1.0/self.gw.n_actions))
+    rewards = np.copy(self.rewards)
+    rewards[0] = np.nan
+    with self.assertRaises(ValueError):
+      value_iteration.value_iteration(self.P_a, rewards, 0.9)
+    with self.assertRaises(ValueError):
+      value_iteration.value_iteration_batch(self.P_a, rewards[:, None], 0.9)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,222 @@
+# Sparse transition dynamics for grid MDPs
+# Each row of a grid MDP has at most N_ACTIONS nonzeros, so the dense
+# NxNxN_ACTIONS P_a tensor is almost entirely zeros. SparseTransitions keeps
+# one CSR matrix per action instead, so memory and build time grow with N.
+#
+# MIT License
+
+import numpy as np
+from scipy import sparse
+from scipy.special import logsumexp
+
+
+class SparseTransitions(object):
+  """
+  Sparse NxNxN_ACTIONS transition dynamics - one NxN CSR matrix per action
+  """
+
+  def __init__(self, mats, grid_shape=None):
+    """
+    input:
+      mats        list of N_ACTIONS NxN matrices - mats[a][s0, s1] is the
+                    transition prob of landing at state s1 when taking
+                    action a at state s0
+      grid_shape  (height, width) of the grid the states were built from
+    """
+    self.mats = [sparse.csr_matrix(m) for m in mats]
+    # a row subset (see row_subset) has fewer rows than columns
+    self.shape = self.mats[0].shape + (len(self.mats),)
+    self.grid_shape = grid_shape
+    # (N_ACTIONS*N)xN - row a*N + s0 holds the transitions of (s0, a)
+    self.stacked = sparse.vstack(self.mats).tocsr()
+
+  @classmethod
+  def from_dense(cls, P_a, grid_shape=None):
+    """
+    build sparse transitions from a dense NxNxN_ACTIONS P_a
+    """
+    return cls([P_a[:, :, a] for a in range(P_a.shape[2])], grid_shape)
+
+  @classmethod
+  def from_triples(cls, n_states, n_actions, s0, s1, a, probs, grid_shape=None):
+    """
+    build sparse transitions from parallel arrays of (s0, s1, a, prob)
+    """
+    s0 = np.asarray(s0)
+    s1 = np.asarray(s1)
+    a = np.asarray(a)
+    probs = np.asarray(probs, dtype=np.float64)
+    mats = []
+    for act in range(n_actions):
+      sel = a == act
+      mats.append(sparse.csr_matrix((probs[sel], (s0[sel], s1[sel])),
+                                    shape=(n_states, n_states)))
+    return cls(mats, grid_shape)
+
+  def action_mat(self, a):
+    """
+    returns
+      NxN CSR matrix of the transitions under action a
+    """
+    return self.mats[a]
+
+  def successors(self, s, a):
+    """
+    returns
+      (states, probs) - the states reachable from s under action a and
+      their probabilities
+    """
+    mat = self.mats[a]
+    start, end = mat.indptr[s], mat.indptr[s + 1]
+    return mat.indices[start:end], mat.data[start:end]
+
+  def expected_next(self, values):
+    """
+    input:
+      values    N (or NxK) vector of next state values
+    returns
+      NxN_ACTIONS (or NxN_ACTIONSxK) - sum_s1 P_a[s0, s1, a]*values[s1]
+    """
+    n_states, _, n_actions = self.shape
+    out = self.stacked.dot(values)
+    return np.moveaxis(np.reshape(out, (n_actions, n_states) + np.shape(values)[1:]), 0, 1)
+
+  def log_expected_next(self, values):
+    """
+    input:
+      values    N vector of next state log values
+    returns
+      NxN_ACTIONS - log sum_s1 P_a[s0, s1, a]*exp(values[s1]), -inf on rows
+      without successors
+    """
+    n_states, _, n_actions = self.shape
+    m = self.stacked
+    v_max = np.max(values)
+    if not np.isfinite(v_max):
+      v_max = 0
+    total = m.dot(np.exp(values - v_max))
+    # rows whose successors are all far below v_max underflow, redo them
+    # shifted by the largest value of their own successors
+    bad = np.nonzero((total < np.finfo(np.float64).tiny) & (np.diff(m.indptr) > 0))[0]
+    with np.errstate(divide='ignore'):
+      out = np.log(total) + v_max
+      if len(bad) > 0:
+        sub = m[bad]
+        rows = np.repeat(np.arange(len(bad)), np.diff(sub.indptr))
+        succ = np.where(sub.data > 0, values[sub.indices], -np.inf)
+        shift = np.full(len(bad), -np.inf)
+        np.maximum.at(shift, rows, succ)
+        shift = np.where(np.isfinite(shift), shift, 0)
+        sums = np.bincount(rows, sub.data*np.exp(succ - shift[rows]), minlength=len(bad))
+        out[bad] = np.log(sums) + shift
+    return np.reshape(out, (n_actions, n_states)).T
+
+  def propagate(self, weights):
+    """
+    forward occupancy propagation
+
+    input:
+      weights   NxN_ACTIONS (or NxN_ACTIONSxK) - mass on each (state, action)
+    returns
+      N (or NxK) vector - sum_{s0, a} weights[s0, a]*P_a[s0, s1, a]
+    """
+    n_states, _, n_actions = self.shape
+    stacked_w = np.reshape(np.moveaxis(weights, 1, 0), (n_actions*n_states,) + np.shape(weights)[2:])
+    return self.stacked.T.dot(stacked_w)
+
+  def row_subset(self, states):
+    """
+    returns
+      SparseTransitions of only the rows of the given states - an
+      n x N x N_ACTIONS operator for backing up just those states
+    """
+    return SparseTransitions([m[states] for m in self.mats], self.grid_shape)
+
+  def todense(self):
+    """
+    returns
+      the equivalent dense NxNxN_ACTIONS transition tensor
+    """
+    return np.stack([m.toarray() for m in self.mats], axis=2)
+
+
+def successors(P_a, s, a):
+  """
+  get the states reachable from s under action a, for dense or sparse P_a
+
+  returns
+    (states, probs) - 1d arrays of next states and their probabilities
+  """
+  if isinstance(P_a, np.ndarray):
+    states = np.nonzero(P_a[s, :, a])[0]
+    return states, P_a[s, states, a]
+  return P_a.successors(s, a)
+
+
+def expected_next(P_a, values):
+  """
+  batched one step look-ahead for dense or sparse P_a
+
+  inputs:
+    P_a       NxNxN_ACTIONS transition dynamics
+    values    N (or NxK) vector of next state values
+  returns
+    NxN_ACTIONS (or NxN_ACTIONSxK) matrix - sum_s1 P_a[s0, s1, a]*values[s1]
+  """
+  if isinstance(P_a, np.ndarray):
+    return np.tensordot(P_a, values, axes=([1], [0]))
+  return P_a.expected_next(values)
+
+
+def log_expected_next(P_a, values):
+  """
+  expected_next in log space for dense or sparse P_a. Each row is a
+  logsumexp over log P_a + values, so it stays finite however far its
+  successors are below the largest value
+
+  inputs:
+    P_a       NxNxN_ACTIONS transition dynamics
+    values    N vector of next state log values
+  returns
+    NxN_ACTIONS matrix - log sum_s1 P_a[s0, s1, a]*exp(values[s1])
+  """
+  if isinstance(P_a, np.ndarray):
+    with np.errstate(divide='ignore'):
+      return logsumexp(np.log(P_a) + values[None, :, None], axis=1)
+  return P_a.log_expected_next(values)
+
+
+def propagate(P_a, weights):
+  """
+  forward occupancy propagation for dense or sparse P_a
+
+  inputs:
+    P_a       NxNxN_ACTIONS transition dynamics
+    weights   NxN_ACTIONS (or NxN_ACTIONSxK) - mass on each (state, action)
+  returns
+    N (or NxK) vector - sum_{s0, a} weights[s0, a]*P_a[s0, s1, a]
+  """
+  if isinstance(P_a, np.ndarray):
+    return np.tensordot(P_a, weights, axes=([0, 2], [0, 1]))
+  return P_a.propagate(weights)
+
+
+def red_black_split(P_a):
+  """
+  split the states of a grid MDP into the two colours of a checkerboard.
+  Under 4-neighbour moves the successors of a state are itself and states
+  of the other colour, so each colour can be backed up in place.
+
+  inputs:
+    P_a     SparseTransitions or StencilTransitions with a grid_shape
+  returns
+    a list of (states, P_sub) pairs - P_sub the row subset of P_a on states
+  """
+  grid_shape = getattr(P_a, 'grid_shape', None)
+  if grid_shape is None:
+    raise ValueError("red-black ordering needs transitions built from a grid")
+  if not isinstance(P_a, SparseTransitions):
+    P_a = P_a.to_sparse()
+  idx = np.arange(P_a.shape[0])
+  colour = (idx % grid_shape[0] + idx // grid_shape[0]) % 2
+  return [(idx[colour == c], P_a.row_subset(idx[colour == c])) for c in [0, 1]]
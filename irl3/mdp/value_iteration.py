@@ -9,9 +9,46 @@
 
 import math
 import numpy as np
+from .transitions import expected_next, red_black_split
 
 
-def value_iteration(P_a, rewards, gamma, error=0.01, deterministic=True):
+def q_values(P_a, rewards, gamma, values, row_sums=None):
+  """
+  batched Bellman backup - Q(s, a) for all states and actions at once
+
+  inputs:
+    P_a         NxNxN_ACTIONS transition dynamics (dense or SparseTransitions)
+    rewards     Nx1 matrix - rewards for all the states
+    gamma       float - RL discount
+    values      Nx1 matrix - current value estimates
+    row_sums    NxN_ACTIONS matrix - sum_s1 P_a[s, s1, a], computed if None
+
+  returns:
+    q           NxN_ACTIONS matrix - sum_s1 P_a[s, s1, a]*(rewards[s] + gamma*values[s1])
+  """
+  rewards = np.reshape(rewards, [-1])
+  if row_sums is None:
+    row_sums = expected_next(P_a, np.ones(len(rewards)))
+  return row_sums*rewards[:, None] + gamma*expected_next(P_a, values)
+
+
+def stochastic_policy(q):
+  """
+  normalize q over the actions (axis 1). States whose q values sum to 0 (a
+  terminal with zero reward) get a uniform policy instead of 0/0
+
+  inputs:
+    q           NxN_ACTIONS (or NxN_ACTIONSxK) matrix
+  returns
+    policy      same shape as q
+  """
+  total = np.sum(q, axis=1, keepdims=True)
+  zero = total == 0
+  return np.where(zero, 1.0/q.shape[1], q/np.where(zero, 1, total))
+
+
+def value_iteration(P_a, rewards, gamma, error=0.01, deterministic=True,
+                    init_values=None, return_sweeps=False, mode='jacobi'):
   """
   static value iteration function. Perhaps the most useful function in this repo
 
@@ -20,57 +57,135 @@ def value_iteration(P_a, rewards, gamma, error=0.01, deterministic=True):
                               P_a[s0, s1, a] is the transition prob of
                               landing at state s1 when taking action
                               a at state s0
+                              (dense array or SparseTransitions)
     rewards     Nx1 matrix - rewards for all the states
     gamma       float - RL discount
     error       float - threshold for a stop
     deterministic   bool - to return deterministic policy or stochastic policy
+    init_values     Nx1 matrix - values to start from (e.g. the previous solve
+                    of a slightly different reward), zeros if None
+    return_sweeps   bool - also return the number of backup sweeps
+    mode        str - 'jacobi' backs up every state from the previous sweep's
+                      values, 'gauss-seidel' backs up the two colours of a
+                      red-black checkerboard in place, each from the latest
+                      values (needs SparseTransitions or StencilTransitions)
 
   returns:
     values    Nx1 matrix - estimated values
     policy    Nx1 (NxN_ACTIONS if non-det) matrix - policy
+    sweeps    int - number of backup sweeps (only if return_sweeps)
   """
-  N_STATES, _, N_ACTIONS = np.shape(P_a)
+  N_STATES, _, N_ACTIONS = P_a.shape
+  # rows of P_a sum to 1 except on obstacle cells, keep the exact weighting
+  row_sums = expected_next(P_a, np.ones(N_STATES))
+
+  if init_values is None:
+    values = np.zeros([N_STATES])
+  else:
+    values = np.array(init_values, dtype=np.float64).reshape([N_STATES])
 
-  values = np.zeros([N_STATES])
+  if mode == 'gauss-seidel':
+    rewards = np.reshape(rewards, [-1])
+    blocks = [(states, P_sub, row_sums[states]) for states, P_sub in red_black_split(P_a)]
+  elif mode != 'jacobi':
+    raise ValueError("Unknown value iteration mode {}".format(mode))
 
   # estimate values
-  counter = 0
+  sweeps = 0
   while True:
-    values_tmp = values.copy()
+    values_tmp = values
+    if mode == 'jacobi':
+      values = np.max(q_values(P_a, rewards, gamma, values_tmp, row_sums), axis=1)
+    else:
+      values = values_tmp.copy()
+      for states, P_sub, sub_row_sums in blocks:
+        q = sub_row_sums*rewards[states, None] + gamma*expected_next(P_sub, values)
+        values[states] = np.max(q, axis=1)
+    sweeps += 1
+
+    delta = np.max(np.abs(values - values_tmp))
+    # a NaN delta is never below error, fail instead of sweeping forever
+    if not np.isfinite(delta):
+      raise ValueError("value iteration got non-finite values, check the rewards")
+    if delta < error:
+      break
 
-    # print(f"Counter is {counter} in infinite loop")
-    counter += 1
+  q = q_values(P_a, rewards, gamma, values, row_sums)
+  if deterministic:
+    # generate deterministic policy
+    policy = np.argmax(q, axis=1).astype(np.float64)
+  else:
+    # generate stochastic policy
+    policy = stochastic_policy(q)
 
-    for s in range(N_STATES):
-      v_s = []
-      values[s] = max([sum([P_a[s, s1, a]*(rewards[s] + gamma*values_tmp[s1]) for s1 in range(N_STATES)]) for a in range(N_ACTIONS)])
+  if return_sweeps:
+    return values, policy, sweeps
+  return values, policy
 
-    if max([abs(values[s] - values_tmp[s]) for s in range(N_STATES)]) < error:
-      break
 
 
-  counter1 = 0
-  if deterministic:
-    # generate deterministic policy
-    print(f"Counter is {counter1} in deterministic")
-    counter += 1
 
-    policy = np.zeros([N_STATES])
-    for s in range(N_STATES):
-      policy[s] = np.argmax([sum([P_a[s, s1, a]*(rewards[s]+gamma*values[s1])
-                                  for s1 in range(N_STATES)])
-                                  for a in range(N_ACTIONS)])
+def value_iteration_batch(P_a, rewards, gamma, error=0.01, deterministic=True,
+                          init_values=None, return_sweeps=False):
+  """
+  value iteration for K reward vectors on the same dynamics at once. Each
+  sweep is one batched backup over all the columns that have not converged
+  yet, and every column stops exactly where value_iteration would.
 
-    return values, policy
-  else:
-    # generate stochastic policy
-    policy = np.zeros([N_STATES, N_ACTIONS])
-    for s in range(N_STATES):
-      v_s = np.array([sum([P_a[s, s1, a]*(rewards[s] + gamma*values[s1]) for s1 in range(N_STATES)]) for a in range(N_ACTIONS)])
-      policy[s,:] = np.transpose(v_s/np.sum(v_s))
-    return values, policy
+  inputs:
+    P_a         NxNxN_ACTIONS transition dynamics (dense, SparseTransitions
+                or StencilTransitions)
+    rewards     NxK matrix - one reward vector per column
+    gamma       float - RL discount
+    error       float - threshold for a stop
+    deterministic   bool - to return deterministic policies or stochastic policies
+    init_values     NxK matrix - values to start from, zeros if None
+    return_sweeps   bool - also return the number of sweeps of each column
 
+  returns:
+    values    NxK matrix - estimated values
+    policy    NxK (NxN_ACTIONSxK if non-det) matrix - policy of each column
+    sweeps    K vector - number of backup sweeps (only if return_sweeps)
+  """
+  rewards = np.asarray(rewards, dtype=np.float64)
+  N_STATES, K = rewards.shape
+  # the reward part of Q(s, a) does not change between sweeps. Computing the
+  # row sums on NxK ones keeps q_rewards in the memory layout of the backups
+  q_rewards = expected_next(P_a, np.ones([N_STATES, K]))*rewards[:, None, :]
+
+  if init_values is None:
+    values = np.zeros([N_STATES, K])
+  else:
+    values = np.array(init_values, dtype=np.float64).reshape([N_STATES, K])
+
+  # estimate values, only sweeping the columns that have not converged
+  sweeps = np.zeros(K, dtype=int)
+  active = np.arange(K)
+  while len(active) > 0:
+    if len(active) == K:
+      values_tmp = values
+      values = np.max(q_rewards + gamma*expected_next(P_a, values_tmp), axis=1)
+    else:
+      values_tmp = values[:, active]
+      values[:, active] = np.max(q_rewards[:, :, active] + gamma*expected_next(P_a, values_tmp),
+                                 axis=1)
+    sweeps[active] += 1
+    delta = np.max(np.abs(values[:, active] - values_tmp), axis=0)
+    if not np.all(np.isfinite(delta)):
+      raise ValueError("value iteration got non-finite values, check the rewards")
+    active = active[delta >= error]
+
+  q = q_rewards + gamma*expected_next(P_a, values)
+  if deterministic:
+    # generate deterministic policies
+    policy = np.argmax(q, axis=1).astype(np.float64)
+  else:
+    # generate stochastic policies
+    policy = stochastic_policy(q)
 
+  if return_sweeps:
+    return values, policy, sweeps
+  return values, policy
 
 
 class ValueIterationAgent(object):
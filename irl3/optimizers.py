@@ -0,0 +1,199 @@
+'''
+Optimizers for the reward weights of MaxEnt IRL
+
+All optimizers maximize. They are driven by an objective
+  evaluate(theta) -> (log_likelihood, grad)
+and stop after n_iters iterations, or earlier once the gradient norm or the
+change in log-likelihood between iterations falls below its tolerance.
+
+MIT License
+'''
+import numpy as np
+from scipy import optimize
+
+
+def converged(grad, ll, ll_prev, grad_tol=None, ll_tol=None):
+  """
+  returns
+    True if |grad| < grad_tol or |ll - ll_prev| < ll_tol
+  """
+  if grad_tol is not None and np.linalg.norm(grad) < grad_tol:
+    return True
+  if ll_tol is not None and ll_prev is not None and abs(ll - ll_prev) < ll_tol:
+    return True
+  return False
+
+
+class GradientAscent(object):
+  """
+  gradient ascent - theta += lr * grad, or with a decaying step
+  lr/(1 + lr_decay*t) at the t-th update
+  """
+
+  # True if the optimizer compares log-likelihoods along the gradient, which
+  # then has to be the exact gradient of the log-likelihood
+  exact_gradient = False
+
+  def __init__(self, lr, lr_decay=0):
+    self.lr = lr
+    self.lr_decay = lr_decay
+    self.n_updates = 0
+    self.ll_prev = None
+
+  def rate(self):
+    return self.lr/(1 + self.lr_decay*self.n_updates)
+
+  def step(self, theta, grad, ll, evaluate):
+    return theta + self.rate()*grad
+
+  def run(self, evaluate, theta, n_iters, grad_tol=None, ll_tol=None, callback=None,
+          start=0, after_step=None):
+    """
+    inputs:
+      evaluate  function - evaluate(theta) returns (log_likelihood, grad)
+      theta     Dx1 vector - initial parameters
+      n_iters   int - maximum number of iterations
+      grad_tol  float - stop once the gradient norm is below it (None to ignore)
+      ll_tol    float - stop once the log-likelihood changes by less than it
+                        between two iterations (None to ignore)
+      callback  function - called as callback(iteration, theta, ll, grad)
+                           before every update
+      start     int - first iteration, to continue an interrupted run
+      after_step  function - called as after_step(n_done, theta) after
+                             every update, with the new theta
+
+    returns
+      theta     Dx1 vector - optimized parameters
+    """
+    for iteration in range(start, n_iters):
+      ll, grad = evaluate(theta)
+      if callback is not None:
+        callback(iteration, theta, ll, grad)
+      if converged(grad, ll, self.ll_prev, grad_tol, ll_tol):
+        break
+      theta = self.step(theta, grad, ll, evaluate)
+      self.n_updates += 1
+      self.ll_prev = ll
+      if after_step is not None:
+        after_step(iteration + 1, theta)
+    return theta
+
+
+class Adam(GradientAscent):
+  """
+  Adam (Kingma & Ba 2015) - per weight step sizes from running moments of
+  the gradient
+  """
+
+  def __init__(self, lr, lr_decay=0, beta1=0.9, beta2=0.999, eps=1e-8):
+    self.lr = lr
+    self.lr_decay = lr_decay
+    self.n_updates = 0
+    self.ll_prev = None
+    self.beta1 = beta1
+    self.beta2 = beta2
+    self.eps = eps
+    self.m = None
+    self.v = None
+
+  def step(self, theta, grad, ll, evaluate):
+    if self.m is None:
+      self.m = np.zeros_like(grad)
+      self.v = np.zeros_like(grad)
+    t = self.n_updates + 1
+    self.m = self.beta1*self.m + (1 - self.beta1)*grad
+    self.v = self.beta2*self.v + (1 - self.beta2)*grad**2
+    m_hat = self.m/(1 - self.beta1**t)
+    v_hat = self.v/(1 - self.beta2**t)
+    return theta + self.rate()*m_hat/(np.sqrt(v_hat) + self.eps)
+
+
+class BacktrackingLineSearch(GradientAscent):
+  """
+  gradient ascent with an Armijo backtracking line search. The step grows
+  after every accepted step and shrinks until the log-likelihood increases
+  enough, starting from lr.
+  """
+
+  exact_gradient = True
+
+  def __init__(self, lr, shrink=0.5, grow=2.0, c=1e-4, max_backtracks=10):
+    self.lr = lr
+    self.shrink = shrink
+    self.grow = grow
+    self.c = c
+    self.max_backtracks = max_backtracks
+    self.n_updates = 0
+    self.ll_prev = None
+
+  def step(self, theta, grad, ll, evaluate):
+    sq_norm = np.dot(grad, grad)
+    for _ in range(self.max_backtracks):
+      candidate = theta + self.lr*grad
+      ll_new, _ = evaluate(candidate)
+      if ll_new >= ll + self.c*self.lr*sq_norm:
+        self.lr *= self.grow
+        return candidate
+      self.lr *= self.shrink
+    return theta + self.lr*grad
+
+
+class LBFGS(object):
+  """
+  L-BFGS through scipy.optimize.minimize - lr is unused, the step sizes come
+  from the curvature estimate and scipy's line search
+  """
+
+  exact_gradient = True
+
+  def __init__(self, lr=None, history=10):
+    self.history = history
+
+  def run(self, evaluate, theta, n_iters, grad_tol=None, ll_tol=None, callback=None,
+          start=0, after_step=None):
+    """
+    same as GradientAscent.run. grad_tol bounds the largest gradient entry
+    and ll_tol the relative change of the log-likelihood, as in scipy.
+    A run continued from start rebuilds its curvature history from scratch.
+    """
+    last = {}
+
+    def fun(theta):
+      ll, grad = evaluate(theta)
+      last['ll'], last['grad'] = ll, grad
+      return -ll, -grad
+
+    def step_callback(theta):
+      if callback is not None:
+        callback(step_callback.iteration, theta, last['ll'], last['grad'])
+      step_callback.iteration += 1
+      if after_step is not None:
+        after_step(step_callback.iteration, theta)
+    step_callback.iteration = start
+
+    if start >= n_iters:
+      return theta
+    options = {'maxiter': n_iters - start, 'maxcor': self.history,
+               'gtol': 1e-5 if grad_tol is None else grad_tol,
+               'ftol': 2.2e-9 if ll_tol is None else ll_tol}
+    res = optimize.minimize(fun, theta, jac=True, method='L-BFGS-B',
+                            callback=step_callback, options=options)
+    return res.x
+
+
+OPTIMIZERS = {'gd': GradientAscent,
+              'adam': Adam,
+              'linesearch': BacktrackingLineSearch,
+              'lbfgs': LBFGS}
+
+
+def get_optimizer(name, lr, **kwargs):
+  """
+  returns
+    a new optimizer of the type registered under name, built with lr and
+    kwargs
+  """
+  try:
+    return OPTIMIZERS[name](lr, **kwargs)
+  except KeyError:
+    raise ValueError("Unknown optimizer {}, expected one of {}".format(name, sorted(OPTIMIZERS)))
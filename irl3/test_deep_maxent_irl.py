@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from . import deep_maxent_irl
+
+
+class NumpyDeepIRLFCTest(unittest.TestCase):
+  """
+  Unit test for the numpy reward network
+  """
+
+  def setUp(self):
+    self.nn_r = deep_maxent_irl.NumpyDeepIRLFC(4, 0.1, 5, 3, l2=0.5)
+    self.feat_map = np.random.uniform(-1, 1, size=(7, 4))
+    self.grad_r = np.random.uniform(-1, 1, size=7)
+
+  def loss(self):
+    rewards = self.nn_r.get_rewards(self.feat_map).ravel()
+    l2_loss = sum(0.5*np.sum(v**2) for v in self.nn_r.theta)
+    return -np.dot(self.grad_r, rewards) + self.nn_r.l2*l2_loss
+
+  def test_grads(self):
+    eps = 1e-6
+    numeric = np.zeros_like(self.nn_r.params)
+    for i in range(len(numeric)):
+      self.nn_r.params[i] += eps
+      loss_plus = self.loss()
+      self.nn_r.params[i] -= 2*eps
+      loss_minus = self.loss()
+      self.nn_r.params[i] += eps
+      numeric[i] = (loss_plus - loss_minus)/(2*eps)
+
+    params = np.copy(self.nn_r.params)
+    grad_theta, _, _ = self.nn_r.apply_grads(self.feat_map, self.grad_r)
+    grad = np.concatenate([np.ravel(g) for g in grad_theta])
+    self.assertTrue(np.allclose(grad, numeric, atol=1e-5))
+    # one plain gradient descent step
+    self.assertTrue(np.allclose(self.nn_r.params, params - 0.1*grad))
+
+  def test_optimizers(self):
+    for optimizer in ['linesearch', 'lbfgs']:
+      with self.assertRaises(ValueError):
+        deep_maxent_irl.NumpyDeepIRLFC(4, 0.1, 5, 3, optimizer=optimizer)
+
+
+if __name__ == '__main__':
+  unittest.main()
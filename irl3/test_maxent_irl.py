@@ -0,0 +1,274 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from .mdp import gridworld
+from .mdp import value_iteration
+from .mdp.stencil import StencilTransitions
+from . import maxent_irl, joint_maxent_irl
+from .utils import Step, flatten_trajs, subset_trajs, demo_svf, unique_rows
+
+
+class StateVisitationTest(unittest.TestCase):
+  """
+  Unit test for the expected state visitation frequencies
+  """
+
+  def setUp(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', '0', '0']]
+
+    self.gw = gridworld.GridWorld(grid, {(0, 4)}, 0.8)
+    self.P_a = self.gw.get_transition_mat()
+    n_states = self.gw.n_states
+    self.trajs = [[Step(cur_state=s, action=0, next_state=s, reward=0, done=False)] * 6
+                  for s in [0, 2, 2, 7, 12]]
+    self.det_policy = np.random.randint(self.gw.n_actions, size=n_states)
+    self.policy = np.random.uniform(size=(n_states, self.gw.n_actions))
+    self.policy = self.policy/np.sum(self.policy, axis=1, keepdims=True)
+
+  def loop_svf(self, policy, deterministic):
+    N_STATES, _, N_ACTIONS = self.P_a.shape
+    T = len(self.trajs[0])
+    mu = np.zeros([N_STATES, T])
+    for traj in self.trajs:
+      mu[traj[0].cur_state, 0] += 1
+    mu[:, 0] = mu[:, 0]/len(self.trajs)
+    for t in range(T-1):
+      for s in range(N_STATES):
+        if deterministic:
+          mu[s, t+1] = sum([mu[pre_s, t]*self.P_a[pre_s, s, int(policy[pre_s])]
+                            for pre_s in range(N_STATES)])
+        else:
+          mu[s, t+1] = sum([sum([mu[pre_s, t]*self.P_a[pre_s, s, a1]*policy[pre_s, a1]
+                                 for a1 in range(N_ACTIONS)]) for pre_s in range(N_STATES)])
+    return np.sum(mu, 1)
+
+  def test_demo_svf(self):
+    expected = np.zeros(self.gw.n_states)
+    for traj in self.trajs:
+      for step in traj:
+        expected[step.cur_state] += 1
+    expected = expected/len(self.trajs)
+    trajs = flatten_trajs(self.trajs)
+    self.assertTrue(np.array_equal(trajs.offsets, [0, 6, 12, 18, 24, 30]))
+    self.assertTrue(np.allclose(demo_svf(trajs, self.gw.n_states), expected))
+    self.assertTrue(np.allclose(demo_svf(self.trajs, self.gw.n_states), expected))
+
+  def test_subset_trajs(self):
+    trajs = [[Step(cur_state=s, action=a, next_state=s, reward=0, done=False)] * n
+             for s, a, n in [(0, 1, 2), (2, 3, 7), (7, 0, 1), (12, 4, 4)]]
+    subset = subset_trajs(trajs, [3, 0])
+    expected = flatten_trajs([trajs[3], trajs[0]])
+    for got, want in zip(subset, expected):
+      self.assertTrue(np.array_equal(got, want))
+
+  def test_svf_mixed_lengths(self):
+    trajs = [[Step(cur_state=s, action=0, next_state=s, reward=0, done=False)] * n
+             for s, n in [(0, 2), (2, 7), (7, 1), (12, 4)]]
+    N_STATES, _, N_ACTIONS = self.P_a.shape
+    for max_horizon in [None, 3]:
+      # every trajectory on its own, for as many steps as it has
+      expected = np.zeros(N_STATES)
+      for traj in trajs:
+        mu = np.zeros(N_STATES)
+        mu[traj[0].cur_state] = 1
+        for t in range(min(len(traj), max_horizon or len(traj))):
+          expected += mu/len(trajs)
+          mu = np.einsum('i,ija,ia->j', mu, self.P_a, self.policy)
+      svf = maxent_irl.compute_state_visition_freq(self.P_a, 0.8, trajs, self.policy,
+                                                   deterministic=False,
+                                                   max_horizon=max_horizon)
+      self.assertTrue(np.allclose(svf, expected))
+
+  def test_svf_batch(self):
+    # datasets of different lengths start at different steps of the pass
+    datasets = [self.trajs[:2], [traj[:3] for traj in self.trajs[2:]], self.trajs]
+    policy = np.random.uniform(size=(self.gw.n_states, self.gw.n_actions, len(datasets)))
+    policy /= np.sum(policy, axis=1, keepdims=True)
+    svf = maxent_irl.compute_state_visition_freq_batch(self.P_a, datasets, policy)
+    for k, trajs in enumerate(datasets):
+      expected = maxent_irl.compute_state_visition_freq(self.P_a, 0.8, trajs, policy[:, :, k],
+                                                        deterministic=False)
+      self.assertTrue(np.allclose(svf[:, k], expected))
+
+  def test_svf(self):
+    for policy, deterministic in [(self.det_policy, True), (self.policy, False)]:
+      expected = self.loop_svf(policy, deterministic)
+      for P_a in [self.P_a, self.gw.get_transition_mat(sparse=True),
+                  StencilTransitions.from_gridworld(self.gw)]:
+        for trajs in [self.trajs, flatten_trajs(self.trajs)]:
+          svf = maxent_irl.compute_state_visition_freq(P_a, 0.8, trajs, policy,
+                                                       deterministic=deterministic)
+          self.assertTrue(np.allclose(svf, expected))
+
+
+class LogLikelihoodTest(unittest.TestCase):
+  """
+  Unit test for the MaxEnt log-likelihood and its gradient
+  """
+
+  def setUp(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', '0', '0']]
+
+    self.gws = [gridworld.GridWorld(grid, {(0, 4)}, 1),
+                gridworld.GridWorld(grid, {(0, 4)}, 0.8)]
+    self.trajs = [[Step(cur_state=s, action=0, next_state=s, reward=0, done=False)] * n
+                  for s, n in [(0, 6), (2, 3), (2, 6), (7, 1), (12, 4)]]
+    self.feat_map = np.random.uniform(size=(self.gws[0].n_states, 3))
+    self.theta = np.random.uniform(size=3)
+
+  def test_gradient(self):
+    feat_exp = np.mean([sum(self.feat_map[step.cur_state] for step in traj)
+                        for traj in self.trajs], axis=0)
+    eps = 1e-6
+    for gw in self.gws:
+      for P_a in [gw.get_transition_mat(), StencilTransitions.from_gridworld(gw)]:
+        _, svf = maxent_irl.maxent_log_likelihood(P_a, self.feat_map.dot(self.theta), self.trajs)
+        grad = feat_exp - self.feat_map.T.dot(svf)
+        numeric = []
+        for e in np.eye(3):
+          ll_plus, _ = maxent_irl.maxent_log_likelihood(
+              P_a, self.feat_map.dot(self.theta + eps*e), self.trajs)
+          ll_minus, _ = maxent_irl.maxent_log_likelihood(
+              P_a, self.feat_map.dot(self.theta - eps*e), self.trajs)
+          numeric.append((ll_plus - ll_minus)/(2*eps))
+        self.assertTrue(np.allclose(grad, numeric, atol=1e-6))
+
+  def test_large_rewards(self):
+    # successors far below the largest value must not underflow to log(0)
+    rewards = self.feat_map.dot(self.theta)*10000
+    for gw in self.gws:
+      lls = [maxent_irl.maxent_log_likelihood(P_a, rewards, self.trajs)[0]
+             for P_a in [gw.get_transition_mat(), StencilTransitions.from_gridworld(gw)]]
+      self.assertTrue(np.all(np.isfinite(lls)))
+      self.assertTrue(np.allclose(lls[0], lls[1]))
+
+  def test_unique_rows(self):
+    P_a = StencilTransitions.from_gridworld(self.gws[1])
+    np.random.seed(0)
+    # few distinct rows, none of them all zero
+    feat_map = np.random.randint(1, 3, size=(self.gws[1].n_states, 3)).astype(np.float64)
+    trajs = flatten_trajs(self.trajs)
+    feat_exp = feat_map.T.dot(demo_svf(trajs, len(feat_map)))
+    feat_rows, inverse = unique_rows(feat_map)
+    self.assertTrue(np.array_equal(feat_rows[inverse], feat_map))
+    plan = value_iteration.value_iteration
+    for exact in [True, False]:
+      ll, grad, _ = maxent_irl.maxent_gradient(feat_map, P_a, 0.8, trajs, feat_exp,
+                                               self.theta, plan, exact=exact)
+      ll_u, grad_u, _ = maxent_irl.maxent_gradient(feat_rows, P_a, 0.8, trajs, feat_exp,
+                                                   self.theta, plan, exact=exact,
+                                                   inverse=inverse)
+      self.assertTrue(np.allclose(grad, grad_u))
+
+
+class JointMaxentTest(unittest.TestCase):
+  """
+  Unit test for the joint multi-region fit
+  """
+
+  def test_matches_single_region(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', '0', '0']]
+    gw = gridworld.GridWorld(grid, {(0, 4)}, 0.8)
+    P_a = StencilTransitions.from_gridworld(gw)
+    trajs = [[Step(cur_state=s, action=0, next_state=s, reward=0, done=False)] * 4
+             for s in [0, 2, 7]]
+    feat_map = np.random.uniform(size=(gw.n_states, 3))
+
+    np.random.seed(0)
+    rewards = maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 5)
+    np.random.seed(0)
+    theta, joint_rewards = joint_maxent_irl.joint_maxent_irl([(feat_map, P_a, trajs)], 0.8, 0.1, 5)
+    self.assertEqual(theta.shape, (3,))
+    self.assertTrue(np.allclose(joint_rewards[0], rewards))
+
+
+class BatchMaxentTest(unittest.TestCase):
+  """
+  Unit test for the lockstep fit of several datasets
+  """
+
+  def test_matches_single_fit(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', '0', '0']]
+    gw = gridworld.GridWorld(grid, {(0, 4)}, 0.8)
+    P_a = StencilTransitions.from_gridworld(gw)
+    trajs = [[Step(cur_state=s, action=0, next_state=s, reward=0, done=False)] * n
+             for s, n in [(0, 4), (2, 2), (7, 5)]]
+    feat_map = np.random.uniform(size=(gw.n_states, 3))
+
+    np.random.seed(0)
+    rewards = maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 5)
+    np.random.seed(0)
+    batch_rewards = maxent_irl.maxent_irl_batch(feat_map, P_a, 0.8, [trajs], 0.1, 5)
+    self.assertEqual(batch_rewards.shape, (gw.n_states, 1))
+    self.assertTrue(np.allclose(batch_rewards[:, 0], rewards))
+
+
+class CheckpointTest(unittest.TestCase):
+  """
+  Unit test for resuming maxent_irl from a checkpoint
+  """
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_resume(self):
+    grid = [['0', '0', '0', '0', '1'],
+            ['0', 'x', '0', '0', '-1'],
+            ['0', '0', '0', '0', '0']]
+    gw = gridworld.GridWorld(grid, {(0, 4)}, 0.8)
+    P_a = StencilTransitions.from_gridworld(gw)
+    trajs = [[Step(cur_state=s, action=0, next_state=s, reward=0, done=False)] * 4
+             for s in [0, 2, 7, 12]]
+    feat_map = np.random.uniform(size=(gw.n_states, 3))
+    path = os.path.join(self.tmpdir, 'checkpoint.npz')
+
+    for optimizer, batch_size in [('gd', None), ('adam', 2)]:
+      np.random.seed(0)
+      full = maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 6, optimizer=optimizer,
+                                   batch_size=batch_size)
+      # stop after 4 iterations, then finish from the checkpoint
+      np.random.seed(0)
+      maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 4, optimizer=optimizer,
+                            batch_size=batch_size, checkpoint_file=path,
+                            checkpoint_every=2, config='test')
+      np.random.seed(1)
+      resumed = maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 6, optimizer=optimizer,
+                                      batch_size=batch_size, checkpoint_file=path,
+                                      resume=True, config='test')
+      self.assertTrue(np.array_equal(full, resumed))
+      with self.assertRaises(ValueError):
+        maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 6, optimizer=optimizer,
+                              checkpoint_file=path, resume=True, config='other')
+
+    # a checkpoint_every of 0 never checkpoints
+    os.remove(path)
+    maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 4, checkpoint_file=path,
+                          checkpoint_every=0)
+    self.assertFalse(os.path.exists(path))
+
+    # runs without a config hash resume too
+    np.random.seed(0)
+    maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 4, checkpoint_file=path,
+                          checkpoint_every=2)
+    resumed = maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 6, checkpoint_file=path,
+                                    resume=True)
+    np.random.seed(0)
+    full = maxent_irl.maxent_irl(feat_map, P_a, 0.8, trajs, 0.1, 6)
+    self.assertTrue(np.array_equal(full, resumed))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,6 +4,114 @@ from collections import namedtuple
 
 Step = namedtuple('Step','cur_state action next_state reward done')
 
+# demonstrations flattened into arrays - the steps of trajectory i are
+# states[offsets[i]:offsets[i+1]] (and the same for actions and next_states)
+TrajArrays = namedtuple('TrajArrays', 'states actions next_states offsets')
+
+
+def flatten_trajs(trajs):
+  """
+  flatten demonstrations once into int32 arrays, so that statistics over the
+  steps are array operations instead of loops over Steps
+
+  input:
+    trajs   list of list of Steps, or TrajArrays (returned as is)
+  returns:
+    TrajArrays - int32 states, actions and next_states of all the steps and
+                 the n_trajs+1 episode offsets
+  """
+  if isinstance(trajs, TrajArrays):
+    return trajs
+  offsets = np.zeros(len(trajs) + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(traj) for traj in trajs])
+  steps = np.array([(step.cur_state, step.action, step.next_state)
+                    for traj in trajs for step in traj], dtype=np.int32).reshape(-1, 3)
+  return TrajArrays(states=steps[:, 0].copy(), actions=steps[:, 1].copy(),
+                    next_states=steps[:, 2].copy(), offsets=offsets)
+
+
+def truncate_trajs(trajs, max_horizon=None):
+  """
+  keep only the first max_horizon steps of every demonstration
+
+  input:
+    trajs         list of list of Steps or TrajArrays
+    max_horizon   int - steps to keep per trajectory, all of them if None
+  returns:
+    TrajArrays
+  """
+  trajs = flatten_trajs(trajs)
+  if max_horizon is None:
+    return trajs
+  lengths = np.diff(trajs.offsets)
+  # position of every step within its own trajectory
+  step_idx = np.arange(len(trajs.states)) - np.repeat(trajs.offsets[:-1], lengths)
+  keep = step_idx < max_horizon
+  offsets = np.zeros_like(trajs.offsets)
+  offsets[1:] = np.cumsum(np.minimum(lengths, max_horizon))
+  return TrajArrays(states=trajs.states[keep], actions=trajs.actions[keep],
+                    next_states=trajs.next_states[keep], offsets=offsets)
+
+
+def subset_trajs(trajs, idx):
+  """
+  input:
+    trajs   list of list of Steps or TrajArrays
+    idx     1d int array - the trajectories to keep
+  returns:
+    TrajArrays of just the trajectories in idx, in that order
+  """
+  trajs = flatten_trajs(trajs)
+  idx = np.asarray(idx, dtype=int)
+  lengths = np.diff(trajs.offsets)[idx]
+  offsets = np.zeros(len(idx) + 1, dtype=trajs.offsets.dtype)
+  offsets[1:] = np.cumsum(lengths)
+  # index of every kept step in the flattened arrays
+  steps = np.repeat(trajs.offsets[idx] - offsets[:-1], lengths) + np.arange(offsets[-1])
+  return TrajArrays(states=trajs.states[steps], actions=trajs.actions[steps],
+                    next_states=trajs.next_states[steps], offsets=offsets)
+
+
+def demo_svf(trajs, n_states):
+  """
+  compute state visitation frequences from demonstrations
+
+  input:
+    trajs   list of list of Steps or TrajArrays - collected from expert
+  returns:
+    p       Nx1 vector - state visitation frequences
+  """
+  trajs = flatten_trajs(trajs)
+  return np.bincount(trajs.states, minlength=n_states)/(len(trajs.offsets) - 1)
+
+
+def unique_rows(feat_map):
+  """
+  deduplicate the feature rows of a map. Bucketed features leave far fewer
+  distinct rows than states, so reward models only need the unique rows.
+
+  input:
+    feat_map  NxD matrix - the features for each state
+  returns:
+    rows      UxD matrix - the distinct feature rows
+    inverse   N int array - state s has the features rows[inverse[s]]
+  """
+  rows, inverse = np.unique(feat_map, axis=0, return_inverse=True)
+  # numpy 2 returns the inverse with an extra axis
+  return rows, np.ravel(inverse)
+
+
+def sum_by_row(inverse, values, n_rows):
+  """
+  inputs:
+    inverse   N int array - from unique_rows
+    values    N vector - a value per state (e.g. an svf or a reward gradient)
+    n_rows    int - number of unique rows
+  returns:
+    U vector - the values summed over the states sharing each feature row
+  """
+  return np.bincount(inverse, weights=np.ravel(values), minlength=n_rows)
+
 
 def normalize(vals):
   """
@@ -1,70 +1,85 @@
 import numpy as np
 import model as mod
 import vultures
-from irl3.mdp import gridworld
-from irl3 import maxent_irl
+import feature_cache
+from irl3.mdp.stencil import StencilTransitions, trajectory_terminals
+from irl3 import joint_maxent_irl
 from irl3 import img_utils
+from irl3.utils import flatten_trajs
 import matplotlib.pyplot as plt
 import time
 
 size = 50
 size = size - 1
-# reward_1_50 location:
-# end_x = 979
-# end_y = 1172
-
-# reward_2_50 location:
-# end_x = 1185
-# end_y = 1300
-
-# reward_3_50 location:
-end_x = 567
-end_y = 762
-
-# Create the vultures model
-model = mod.Model(end_x - size, end_x, end_y - size, end_y)
+# Bottom right corners of the regions fit together, one reward per region
+# reward_1_50, reward_2_50 and reward_3_50 locations:
+corners = [(979, 1172),
+           (1185, 1300),
+           (567, 762)]
 # 50x50 one
 # model = mod.Model(930, 979, 1128, 1172)
 
-try:
-    with open('bird_coords.dat', 'r') as file:
-        traj_list = eval(file.read())
-        trajectories = model.get_trajectories(traj_list)
+
+def load_coords():
+    """Returns the list of bird coordinate lists, generating the cached
+    bird_coords.dat if needed"""
+
+    try:
+        with open('bird_coords.dat', 'r') as file:
+            coords_list = eval(file.read())
+            file.close()
+    except IOError:
+        print("File for birds not found, will generate")
+        # Read the vulture data
+        df = vultures.read_file()
+        # Narrow down birds to those deemed acceeptable
+        west_birds = vultures.get_data_by_name(df, vultures.get_west_names())
+        file = open('bird_coords.dat', 'w')
+        coords_list = list([list(mod.get_coords(bird)) for bird in west_birds])
+        file.write(str(coords_list))
         file.close()
-except IOError:
-    print("File for birds not found, will generate")
-    # Read the vulture data
-    df = vultures.read_file()
-    # Narrow down birds to those deemed acceeptable
-    west_birds = vultures.get_data_by_name(df, vultures.get_west_names())
-    file = open('bird_coords.dat', 'w')
-    coords_list = list([list(mod.get_coords(bird)) for bird in west_birds])
-    file.write(str(coords_list))
-    file.close()
+    return coords_list
+
+
+def build_region(end_x, end_y, coords_list):
+    """Returns the (feature matrix, transition dynamics, trajectories) of
+    the size x size region ending at (end_x, end_y)"""
+
+    # Create the vultures model
+    model = mod.Model(end_x - size, end_x, end_y - size, end_y)
     trajectories = model.get_trajectories(coords_list)
 
-feature_matrix = model.get_feature_matrix()
-assert feature_matrix is not None
+    feature_matrix = feature_cache.get_feature_matrix(model)
+    assert feature_matrix is not None
+
+    for traj in trajectories:
+        assert traj is not None
+    # Find the terminal points from the trajectories, the last state of a
+    # bird that leaves the region is the last one inside it
+    terminals = trajectory_terminals(trajectories, model.shape[0],
+                                     model.shape[1])
+
+    print("Getting Transition Probabilities")
+    # Get Transition Probabilities as array shifts on the model's grid
+    P_a = StencilTransitions(model.shape[0], model.shape[1],
+                             terminals=terminals)
+    # Flatten the trajectories into arrays once for all the IRL passes
+    return feature_matrix, P_a, flatten_trajs(trajectories)
+
 
-for traj in trajectories:
-    assert traj is not None
-# Find the terminal points from the trajectories
-terminals = list(map(lambda traj: traj[-1].next_state, trajectories))
+if __name__ == '__main__':
+    coords_list = load_coords()
+    regions = [build_region(end_x, end_y, coords_list)
+               for end_x, end_y in corners]
 
-# Create a giant empty grid for the gridworld
-grid = [[0 for i in range(model.shape[0])] for j in range(model.shape[1])]
-# Create the gridworld
-print("Creating the GridWorld")
-gw = gridworld.GridWorld(grid, terminals)
-print("Getting Transition Probabilities")
-# Get Transition Probabilities
-P_a = gw.get_transition_mat()
-# Create matrix for rewards
-print("Running MaxEnt IRL")
-start = time.time()
-rewards_maxent = maxent_irl.maxent_irl(feature_matrix, P_a, 0.8,
-                                       trajectories, 0.02, 20, error=0.1)
-end = time.time()
-print(end - start)
+    # One shared reward weight vector, each region in its own process
+    print("Running joint MaxEnt IRL")
+    start = time.time()
+    theta, rewards = joint_maxent_irl.joint_maxent_irl(regions, 0.8, 0.02, 20,
+                                                       error=0.1)
+    end = time.time()
+    print(end - start)
 
-np.save(f"rewards_{size+1}.npy", rewards_maxent)
+    np.save(f"theta_{size+1}.npy", theta)
+    for i, rewards_maxent in enumerate(rewards):
+        np.save(f"rewards_{size+1}_{i+1}.npy", rewards_maxent)
@@ -8,19 +8,28 @@ from functools import reduce
 import operator
 import itertools
 from return_pixel import return_pixel
+from raster_stack import RasterStack
 import vultures
 from collections import namedtuple
 import random
+import os
 
 Step = namedtuple('Step', 'cur_state action next_state reward done')
 
+# linear: equal width buckets centered on min and max (the original scheme)
+# quantile: equal frequency buckets over the whole raster
+# log: equal width buckets of log(1 + value - min)
+# edges: buckets between explicitly given edges
+BUCKET_SCHEMES = ["linear", "quantile", "log", "edges"]
+
 
 class Feature:
     """Class which represents a single feature of the data to be used
     for learning rewards"""
 
     def __init__(self, name, buckets,
-                 max=None, min=None, custom_func=None, file=None):
+                 max=None, min=None, custom_func=None, file=None,
+                 stack=None, scheme="linear", edges=None):
         """Initialize feature with name and number of buckets.
         If provided, custom_func sets the function to be called to
         aquire a value for this feature at a given x, y coord, to be
@@ -32,26 +41,50 @@ class Feature:
         data file from which a pixel array of values can be generated
         for this feature. Default assumes it is called name.txt where
         name is the parameter passed in.
+        If provided, stack is the filename of a raster stack (see
+        raster_stack.py) and file the name of the feature's layer in it,
+        by default name. The layer is memory-mapped, so only the windows
+        that are used are ever read.
+        scheme is one of BUCKET_SCHEMES. Except for linear, values are
+        bucketed by searching a sorted array of inner bucket edges. edges
+        are those edges, required for the edges scheme; for quantile and
+        log they are computed over the whole raster the first time they
+        are needed and cached in a file beside it.
         """
 
         self.name = name
         self.buckets = int(buckets)
         self.custom_func = custom_func
+        self.stack = stack
+        self.scheme = scheme
+        self.edges = None
 
         if file is None:
-            self.file = f"{self.name}.npy"
+            self.file = self.name if stack is not None else f"{self.name}.npy"
         else:
             self.file = file
 
         if custom_func is None:
             self.function = self.get_value
-            try:
-                self.data = np.load(self.file, allow_pickle=True)
-            except IOError:
-                print(f"There was a problem with the numpy file {self.file}")
-                exit(1)
-            self.max = self.data.max()
-            self.min = self.data.min()
+            if stack is not None:
+                try:
+                    layers = RasterStack(stack)
+                    self.data = layers.layer(self.file)
+                except (IOError, KeyError, ValueError) as e:
+                    print(f"There was a problem with the raster stack {stack}")
+                    print(e)
+                    exit(1)
+                # the header has the range, so no pass over the data is needed
+                self.max = layers.max(self.file)
+                self.min = layers.min(self.file)
+            else:
+                try:
+                    self.data = np.load(self.file, allow_pickle=True)
+                except IOError:
+                    print(f"There was a problem with the numpy file {self.file}")
+                    exit(1)
+                self.max = self.data.max()
+                self.min = self.data.min()
         else:
             self.function = custom_func
             self.max = max
@@ -61,11 +94,77 @@ class Feature:
                 raise AttributeError(
                     "Min and Max must be passed for custom  function")
 
+        self.set_scheme(scheme, edges)
+
     def __repr__(self):
         """How the feature should represent itself"""
 
         return f"{self.name} feature with {self.buckets} buckets"
 
+    def set_scheme(self, scheme, edges=None):
+        """Switches to the bucket scheme scheme. For the edges scheme,
+        edges are the inner bucket edges and set the number of buckets.
+        For the others, edges that do not fit the number of buckets are
+        dropped and computed again when needed"""
+
+        if scheme not in BUCKET_SCHEMES:
+            raise ValueError(f"Unknown bucket scheme {scheme}, expected "
+                             f"one of {BUCKET_SCHEMES}")
+        if scheme == "edges":
+            if edges is None:
+                raise ValueError("The edges scheme needs a list of edges")
+            self.buckets = len(edges) + 1
+        if scheme in ["quantile", "log"] and self.custom_func is not None:
+            raise ValueError(f"The {scheme} scheme needs a raster feature")
+        self.scheme = scheme
+        self.edges = None if edges is None else np.asarray(edges, dtype=np.float64)
+
+    def edge_file(self):
+        """Returns the filename of the cached edges of the current scheme"""
+
+        layer = self.file if self.stack is None else f"{self.stack}.{self.file}"
+        return f"{layer}.{self.scheme}{self.buckets}.edges.npy"
+
+    def compute_edges(self):
+        """Returns the inner bucket edges of the quantile or log scheme over
+        every value of the raster but the -1 sentinel"""
+
+        values = np.asarray(self.data)
+        if values.dtype == object:
+            values = values.astype(np.float64)
+        values = values[values != -1]
+        if self.scheme == "quantile":
+            return np.quantile(values, np.arange(1, self.buckets) / self.buckets)
+        low = values.min()
+        steps = np.linspace(0, np.log1p(values.max() - low), self.buckets + 1)
+        return low + np.expm1(steps[1:-1])
+
+    def get_edges(self):
+        """Returns the inner bucket edges of the scheme, computing them once
+        per layer and caching them beside it"""
+
+        if self.edges is not None and (self.scheme == "edges" or
+                                       len(self.edges) == self.buckets - 1):
+            return self.edges
+        source = self.file if self.stack is None else self.stack
+        cache = self.edge_file()
+        try:
+            if os.path.getmtime(cache) >= os.path.getmtime(source):
+                self.edges = np.load(cache)
+                return self.edges
+        except OSError:
+            pass
+        print(f"Computing {self.scheme} bucket edges of {self.name}")
+        self.edges = self.compute_edges()
+        try:
+            tmp = cache + ".tmp"
+            with open(tmp, "wb") as file:
+                np.save(file, self.edges)
+            os.replace(tmp, cache)
+        except OSError:
+            print(f"Could not cache the bucket edges to {cache}")
+        return self.edges
+
     def get_bucket(self, value):
         """Returns the bucket number that a given value should be placed in
         for a given feature, given numbers representing the max and min of
@@ -73,9 +172,44 @@ class Feature:
         if value == -1:
             return -1
 
+        if self.scheme != "linear":
+            return int(np.searchsorted(self.get_edges(), value, side="right"))
+
         normal = (value - self.min) / (self.max - self.min)
         return int(round((self.buckets - 1) * normal))
 
+    def get_buckets(self, values):
+        """Vectorized get_bucket. Returns an int array of the buckets of
+        an array of values, with -1 wherever the value is -1"""
+
+        values = np.asarray(values)
+        if values.dtype == object:
+            # boxed python numbers bucket like get_bucket does in float64
+            values = values.astype(np.float64)
+        if self.scheme != "linear":
+            buckets = np.searchsorted(self.get_edges(), values, side="right")
+        else:
+            normal = (values - self.min) / (self.max - self.min)
+            buckets = np.round((self.buckets - 1) * normal).astype(np.int64)
+        return np.where(values == -1, -1, buckets)
+
+    def get_bucket_window(self, x_start, x_end, y_start, y_end):
+        """Returns the buckets of every pixel of the window from
+        (x_start, y_start) to (x_end, y_end) inclusive, as a
+        (y_end + 1 - y_start) by (x_end + 1 - x_start) int array.
+        Pixels past the edge of the data get bucket -1, as get_value
+        does"""
+
+        buckets = np.full((y_end + 1 - y_start, x_end + 1 - x_start), -1,
+                          dtype=np.int64)
+        window = self.data[y_start:y_end + 1, x_start:x_end + 1]
+        if window.shape != buckets.shape:
+            print(f"Shape of data is {self.data.shape}")
+            print(f"The window past ({window.shape[1] + x_start - 1}, "
+                  f"{window.shape[0] + y_start - 1}) is off the data")
+        buckets[:window.shape[0], :window.shape[1]] = self.get_buckets(window)
+        return buckets
+
     def get_value(self, x, y):
         """Default data reading function. Should access an array read from
         the contents of the file named at self.file, then access
@@ -173,17 +307,26 @@ class Model:
             f = np.zeros((self.size, len(features)), dtype=np.uint8)
             for i in range(len(features)):
                 feature = self.feature_dict[features[i]]
+                if feature.custom_func is None:
+                    # state y + x * H is the column-major order of the window.
+                    # astype wraps the -1 buckets around like the assignment
+                    # of single buckets did
+                    window = feature.get_bucket_window(self.x_start,
+                                                       self.x_end,
+                                                       self.y_start,
+                                                       self.y_end)
+                    f[:, i] = np.ravel(window, order='F').astype(np.uint8)
+                    continue
                 for y in range(self.shape[0]):
                     for x in range(self.shape[1]):
-                        value = feature.get_value(x + self.x_start,
-                                                  y + self.y_start)
+                        value = feature.function(x + self.x_start,
+                                                 y + self.y_start)
                         bucket = feature.get_bucket(value)
                         f[y + x * self.shape[0], i] = bucket
 
             return f
-        except IndexError as e:
+        except KeyError as e:
             print("One of the features provided was unknown")
-            print(f"x was {x} and y was {y}")
             raise e
 
     def get_state(self, x, y):
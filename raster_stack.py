@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Memory-mapped stack of typed feature rasters
+#
+# A stack file is the magic bytes RSTK, the length of a json header as a
+# little-endian uint32, the json header, and then the raw layers. The
+# header gives the dtype, shape, byte offset, min and max of every layer,
+# so opening a stack reads nothing but the header and every layer is an
+# np.memmap that only pages in the windows that are sliced out of it.
+
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+MAGIC = b"RSTK"
+# layers start on multiples of this many bytes
+ALIGN = 64
+
+
+def compact_array(arr):
+    """Returns arr in the smallest native dtype that holds its values.
+    Object arrays (from np.full((h, w), None)) are converted first, with
+    None as the -1 sentinel. Integer valued layers become uint8, int16 or
+    int32 and all other layers float32"""
+
+    arr = np.asarray(arr)
+    if arr.dtype == object:
+        arr = np.array([-1 if value is None else value for value in arr.ravel()],
+                       dtype=np.float64).reshape(arr.shape)
+    if arr.dtype == bool:
+        return arr.astype(np.uint8)
+    if arr.size == 0:
+        return arr.astype(np.float32)
+    if np.issubdtype(arr.dtype, np.floating) and np.any(arr != np.round(arr)):
+        return arr.astype(np.float32)
+    low, high = arr.min(), arr.max()
+    for dtype in [np.uint8, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return arr.astype(dtype)
+    return arr.astype(np.float32)
+
+
+def write_stack(filename, layers):
+    """Writes a dictionary of layer names to 2d arrays to a stack file.
+    Every layer is stored with compact_array. The file is replaced
+    atomically, so readers never see a half written stack"""
+
+    arrays = {name: compact_array(layer) for name, layer in layers.items()}
+    header = {}
+    offset = 0
+    for name, arr in arrays.items():
+        header[name] = {"dtype": arr.dtype.str,
+                        "shape": list(arr.shape),
+                        "offset": offset,
+                        "min": arr.min().item() if arr.size else 0,
+                        "max": arr.max().item() if arr.size else 0}
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    encoded = json.dumps({"layers": header}).encode()
+    start = -(-(len(MAGIC) + 4 + len(encoded)) // ALIGN) * ALIGN
+
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(encoded)))
+        file.write(encoded)
+        for name, arr in arrays.items():
+            file.seek(start + header[name]["offset"])
+            file.write(np.ascontiguousarray(arr).tobytes())
+        file.truncate(start + offset)
+    os.replace(tmp, filename)
+
+
+class RasterStack:
+    """Read only view of a stack file. Layers are memory-mapped on first
+    use"""
+
+    def __init__(self, filename):
+        """Reads the header of the stack file filename"""
+
+        self.filename = filename
+        with open(filename, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{filename} is not a raster stack")
+            length, = struct.unpack("<I", file.read(4))
+            self.header = json.loads(file.read(length).decode())["layers"]
+        self.start = -(-(len(MAGIC) + 4 + length) // ALIGN) * ALIGN
+        self.layers = {}
+
+    def __contains__(self, name):
+        return name in self.header
+
+    def names(self):
+        """Returns the names of the layers of the stack"""
+
+        return list(self.header.keys())
+
+    def layer(self, name):
+        """Returns the layer called name as a read only np.memmap"""
+
+        if name not in self.header:
+            raise KeyError(f"{self.filename} has no layer {name}")
+        if name not in self.layers:
+            info = self.header[name]
+            self.layers[name] = np.memmap(self.filename, mode="r",
+                                          dtype=np.dtype(info["dtype"]),
+                                          offset=self.start + info["offset"],
+                                          shape=tuple(info["shape"]))
+        return self.layers[name]
+
+    def min(self, name):
+        """Returns the smallest value of the layer called name"""
+
+        return self.header[name]["min"]
+
+    def max(self, name):
+        """Returns the largest value of the layer called name"""
+
+        return self.header[name]["max"]
+
+
+def convert_npy(filename, npy_files):
+    """Adds the .npy rasters in npy_files to the stack file filename
+    (created if needed), as layers named after the files. Layers already in
+    the stack are kept unless a file of the same name replaces them"""
+
+    layers = {}
+    if os.path.exists(filename):
+        stack = RasterStack(filename)
+        layers = {name: np.array(stack.layer(name)) for name in stack.names()}
+    for npy_file in npy_files:
+        name = os.path.splitext(os.path.basename(npy_file))[0]
+        print(f"Converting {npy_file} to layer {name}")
+        layers[name] = np.load(npy_file, allow_pickle=True)
+    write_stack(filename, layers)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: raster_stack.py STACK_FILE LAYER.npy [LAYER.npy ...]")
+        exit(1)
+    convert_npy(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,230 @@
+# Hyperparameter sweeps for the traxent reward maps
+
+import contextlib
+import csv
+import datetime
+import io
+import itertools
+import multiprocessing
+import time
+import traceback
+import numpy as np
+from irl3.mdp.stencil import StencilTransitions, trajectory_terminals
+from irl3.mdp.planners import get_planner
+from irl3.utils import flatten_trajs, subset_trajs, demo_svf, unique_rows
+from irl3.utils import sum_by_row
+from irl3 import maxent_irl
+import feature_cache
+
+# grid entries named "buckets <feature>" change that feature's bucket count
+BUCKETS_PREFIX = "buckets "
+
+# Set in every pool worker by init_worker, so the shared arrays are sent to
+# each worker once instead of once per run
+_shared = {}
+
+
+def prepare_mdp(model, filename):
+    """Reads the trajectories in filename and builds the dynamics of the
+    model's grid. Returns the flattened trajectories and the
+    StencilTransitions of the grid
+    """
+
+    try:
+        with open(filename, 'r') as file:
+            traj_list = eval(file.read())
+            trajectories = model.get_trajectories(traj_list)
+    except IOError:
+        raise ValueError("File for animals not found, please generate using option 6")
+
+    for traj in trajectories:
+        assert traj is not None
+    # Find the terminal points from the trajectories, the last state of a
+    # bird that leaves the region is the last one inside it
+    terminals = trajectory_terminals(trajectories, model.shape[0],
+                                     model.shape[1])
+
+    print("Getting Transition Probabilities")
+    # Get Transition Probabilities as array shifts on the model's grid
+    P_a = StencilTransitions(model.shape[0], model.shape[1],
+                             terminals=terminals)
+    # Flatten the trajectories into arrays once for all the IRL passes
+    return flatten_trajs(trajectories), P_a
+
+
+def expand_grid(grid):
+    """Returns one dictionary per combination of the values in grid, a
+    dictionary of hyperparameter names to lists of values"""
+
+    names = sorted(grid.keys())
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def split_trajectories(trajectories, held_out, seed=0):
+    """Splits the trajectories at random into a training and a held-out set,
+    holding out a fraction held_out of them (at least one trajectory is
+    always kept for training)"""
+
+    n_trajs = len(trajectories.offsets) - 1
+    order = np.random.RandomState(seed).permutation(n_trajs)
+    n_held = min(int(round(held_out * n_trajs)), n_trajs - 1)
+    return (subset_trajs(trajectories, np.sort(order[n_held:])),
+            subset_trajs(trajectories, np.sort(order[:n_held])))
+
+
+def bucket_counts(model, setting):
+    """Returns the bucket count of every feature of the model under a sweep
+    setting, as a tuple in the order of the model's features"""
+
+    return tuple(int(setting.get(BUCKETS_PREFIX + name, feature.buckets))
+                 for name, feature in model.feature_dict.items())
+
+
+def feature_matrices(model, settings):
+    """Builds the feature matrix once for every distinct bucket count in
+    settings. Returns a dictionary from bucket_counts to feature matrix"""
+
+    features = list(model.feature_dict.values())
+    original = [feature.buckets for feature in features]
+    matrices = {}
+    try:
+        for setting in settings:
+            counts = bucket_counts(model, setting)
+            if counts in matrices:
+                continue
+            for feature, buckets in zip(features, counts):
+                feature.buckets = buckets
+            matrices[counts] = feature_cache.get_feature_matrix(model)
+    finally:
+        for feature, buckets in zip(features, original):
+            feature.buckets = buckets
+    return matrices
+
+
+def init_worker(shared):
+    """Pool initializer, keeps the shared precomputation for every run"""
+
+    _shared.update(shared)
+
+
+def fit(job):
+    """Fits one sweep setting in a pool worker. Returns the job's index,
+    setting, and either the metrics of the run or the traceback of its
+    failure"""
+
+    index, hyperparams, counts, save_file = job
+    feature_matrix = _shared["feature matrices"][counts]
+    P_a = _shared["P_a"]
+    train = _shared["train"]
+    held_out = _shared["held out"]
+    gamma = hyperparams["discount factor"]
+    try:
+        # keep the per iteration logs of the parallel runs off the terminal
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.time()
+            np.random.seed(_shared["seed"] + index)
+            rewards, theta = maxent_irl.maxent_irl(
+                feature_matrix, P_a, gamma, train,
+                hyperparams["learning rate"], hyperparams["iterations"],
+                planner=hyperparams.get("planner", "vi"),
+                optimizer=hyperparams.get("optimizer", "gd"),
+                grad_tol=hyperparams.get("gradient tolerance", 0) or None,
+                ll_tol=hyperparams.get("likelihood tolerance", 0) or None,
+                max_horizon=hyperparams.get("max horizon", 0) or None,
+                return_theta=True)
+            runtime = time.time() - start
+
+            # the exact gradient at the final weights, so the norm means the
+            # same thing whatever the optimizer
+            feat_rows, inverse = unique_rows(feature_matrix)
+            feat_exp = feat_rows.T.dot(sum_by_row(
+                inverse, demo_svf(train, P_a.shape[0]), len(feat_rows)))
+            _, grad, _ = maxent_irl.maxent_gradient(
+                feat_rows, P_a, gamma, train, feat_exp, theta,
+                get_planner("vi"), exact=True, inverse=inverse)
+            if len(held_out.offsets) > 1:
+                held_out_ll, _ = maxent_irl.maxent_log_likelihood(
+                    P_a, np.dot(feat_rows, theta)[inverse], held_out)
+            else:
+                held_out_ll = float("nan")
+        np.save(save_file, rewards)
+    except Exception:
+        return index, hyperparams, None, traceback.format_exc()
+    metrics = {"runtime": runtime,
+               "gradient norm": np.linalg.norm(grad),
+               "held-out log-likelihood": held_out_ll,
+               "output": save_file + ".npy"}
+    return index, hyperparams, metrics, None
+
+
+def run_sweep(model, filename, hyperparams, grid, held_out=0.2,
+              processes=None, results_file=None, seed=0):
+    """Fits a MaxEnt reward map for every combination of the values in grid,
+    a dictionary of hyperparameter names (or "buckets <feature>") to lists
+    of values. Settings missing from grid are taken from hyperparams.
+    The trajectories, the dynamics and one feature matrix per distinct
+    bucket count are computed once and shared by a pool of processes
+    workers (one per core if None). A fraction held_out of the
+    trajectories is kept out of training to score the runs.
+    Writes a csv of the runtime, the final gradient norm, the held-out
+    log-likelihood and the rewards file of every run, and returns its name
+    """
+
+    for name in grid:
+        if name.startswith(BUCKETS_PREFIX):
+            if name[len(BUCKETS_PREFIX):] not in model.feature_dict:
+                raise ValueError(f"Unknown feature in sweep: {name}")
+        elif name not in hyperparams:
+            raise ValueError(f"Unknown hyperparameter in sweep: {name}")
+
+    settings = expand_grid(grid)
+    trajectories, P_a = prepare_mdp(model, filename)
+    train, test = split_trajectories(trajectories, held_out, seed)
+    print("Building feature matrices")
+    matrices = feature_matrices(model, settings)
+
+    first_dim = model.shape[0]
+    last_dim = model.shape[1]
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    if results_file is None:
+        results_file = f"sweep_{first_dim}x{last_dim}_{timestamp}.csv"
+
+    jobs = []
+    for index, setting in enumerate(settings):
+        run_hyperparams = dict(hyperparams)
+        run_hyperparams.update((name, value) for name, value in setting.items()
+                               if not name.startswith(BUCKETS_PREFIX))
+        save_file = (f"rewards_{first_dim}x{last_dim}_sweep{index}"
+                     f"_{timestamp}")
+        jobs.append((index, run_hyperparams, bucket_counts(model, setting),
+                     save_file))
+
+    shared = {"P_a": P_a, "train": train, "held out": test,
+              "feature matrices": matrices, "seed": seed}
+    names = sorted(grid.keys())
+    columns = ["run"] + names + ["runtime", "gradient norm",
+                                 "held-out log-likelihood", "output", "error"]
+    print(f"Running {len(jobs)} fits, results in {results_file}")
+    with open(results_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        with multiprocessing.Pool(processes, initializer=init_worker,
+                                  initargs=(shared,)) as pool:
+            # rows are written as runs finish, so an interrupted sweep keeps
+            # the results it has
+            for index, _, metrics, error in \
+                    pool.imap_unordered(fit, jobs):
+                setting = settings[index]
+                row = [index] + [setting[name] for name in names]
+                if error is None:
+                    print(f"Run {index} finished in {metrics['runtime']:.1f}s")
+                    row += [metrics["runtime"], metrics["gradient norm"],
+                            metrics["held-out log-likelihood"],
+                            metrics["output"], ""]
+                else:
+                    print(f"Run {index} failed:\n{error}")
+                    row += ["", "", "", "", error.strip().splitlines()[-1]]
+                writer.writerow(row)
+                file.flush()
+    return results_file
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from model import Feature, Model
+
+
+class FeatureMatrixTest(unittest.TestCase):
+    """Unit test for the vectorized feature matrix builder"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        layers = {"uint8": rng.randint(0, 200, size=(9, 7)).astype(np.uint8),
+                  "float": rng.uniform(-3, 5, size=(9, 7)),
+                  # as written by feature_matrices.py, -1 where there is
+                  # no value
+                  "object": rng.randint(-1, 40, size=(9, 7)).astype(object)}
+        layers["float"][2, 3] = -1
+        self.features = {}
+        for name, layer in layers.items():
+            filename = os.path.join(self.tmpdir, f"{name}.npy")
+            np.save(filename, layer)
+            self.features[name] = Feature(name, 5, file=filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def loop_matrix(self, model):
+        """The feature matrix built one pixel at a time"""
+
+        f = np.zeros((model.size, len(model.feature_dict)), dtype=np.int64)
+        for i, feature in enumerate(model.feature_dict.values()):
+            for y in range(model.shape[0]):
+                for x in range(model.shape[1]):
+                    value = feature.get_value(x + model.x_start,
+                                              y + model.y_start)
+                    f[y + x * model.shape[0], i] = feature.get_bucket(value)
+        # -1 buckets wrap around in the uint8 matrix
+        return f.astype(np.uint8)
+
+    def test_matches_loop(self):
+        # windows inside the data and hanging off its right and bottom edges
+        for bounds in [(0, 6, 0, 8), (2, 5, 3, 7), (4, 9, 6, 11)]:
+            model = Model(*bounds)
+            model.feature_dict = dict(self.features)
+            self.assertTrue(np.array_equal(model.get_feature_matrix(),
+                                           self.loop_matrix(model)))
+
+
+if __name__ == '__main__':
+    unittest.main()
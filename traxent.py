@@ -7,10 +7,14 @@ import json
 import time
 import datetime
 import glob
-from irl3.mdp import gridworld
-from irl3 import maxent_irl, deep_maxent_irl
+from irl3.mdp.planners import PLANNERS
+from irl3.optimizers import OPTIMIZERS
+from irl3.checkpoint import config_hash
+from irl3 import maxent_irl, deep_maxent_irl, bootstrap_irl
 import model as mod
 import move_data
+import feature_cache
+from sweep import prepare_mdp, run_sweep
 from draw_plot import draw_plot
 
 parser = argparse.ArgumentParser()
@@ -18,6 +22,13 @@ parser.add_argument(
     "-d", "--data", action="append", nargs=2,
     help="Specify a data filename followed by #buckets")
 parser.add_argument("-c", "--config", help="Specify a configuration file")
+parser.add_argument("-r", "--resume",
+                    help="Continue an interrupted reward map from its checkpoint")
+parser.add_argument("-s", "--sweep",
+                    help="Run a hyperparameter sweep from a json file of "
+                         "hyperparameter names to lists of values, then exit")
+parser.add_argument("-p", "--processes", type=int,
+                    help="Number of parallel fits in a sweep (default: one per core)")
 args = parser.parse_args()
 
 
@@ -48,35 +59,24 @@ def read_config(filename="traxent.cfg"):
         hyperparams = {"learning rate": 0.02,
                        "discount factor": 0.8,
                        "iterations": 20}
+    # configurations written before the planner and optimizer could be chosen
+    hyperparams.setdefault("planner", "vi")
+    hyperparams.setdefault("optimizer", "gd")
+    hyperparams.setdefault("gradient tolerance", 0)
+    hyperparams.setdefault("likelihood tolerance", 0)
+    hyperparams.setdefault("max horizon", 0)
+    hyperparams.setdefault("deep backend", "numpy")
+    hyperparams.setdefault("checkpoint every", 5)
+    hyperparams.setdefault("bootstrap samples", 50)
 
     data_file = config["data file"]
 
     return new_model, hyperparams, data_file
 
 
-def write_config(model, data_file, hyperparams={}, filename="traxent.cfg"):
-    """Writes model with features and a dictionary of hyperparameters to
-    a json dictionary file specified by filename, which defaults to traxent.cfg
-    """
-
-    existing = None
-    try:
-        existing = json.load(open(filename, "r"))
-    except IOError:
-        print("No existing configuration found")
-
-    file = open(filename, "w")
-
-    try:
-        if existing is not None:
-            print(f"Found existing configuration file at {filename}")
-            print(f"Backing up to {filename}.bak")
-            backup = open(f"{filename}.bak", "w")
-            json.dump(existing, backup)
-            backup.close()
-    except IOError:
-        print("Could not write backup file")
-        exit(1)
+def get_config(model, data_file, hyperparams):
+    """Returns the json dictionary describing the model with its features,
+    the data file and the hyperparameters"""
 
     config = {}
     config["hyperparams"] = hyperparams
@@ -99,74 +99,202 @@ def write_config(model, data_file, hyperparams={}, filename="traxent.cfg"):
         feature_config["min"] = int(obj.min)
         feature_config["custom_func"] = obj.custom_func
         feature_config["file"] = obj.file
+        feature_config["stack"] = obj.stack
+        feature_config["scheme"] = obj.scheme
+        # the edges are recorded so that a saved model buckets the same way
+        if obj.scheme == "linear":
+            feature_config["edges"] = None
+        else:
+            feature_config["edges"] = obj.get_edges().tolist()
         features_config[feature] = feature_config
 
     config["features"] = features_config
 
     config["data file"] = data_file
 
-    json.dump(config, file)
-    file.close()
+    return config
 
 
-def irl_rewards(model, filename, hyperparams, deep=False):
-    """Do everything irl_vultures does
+def write_config(model, data_file, hyperparams={}, filename="traxent.cfg"):
+    """Writes model with features and a dictionary of hyperparameters to
+    a json dictionary file specified by filename, which defaults to traxent.cfg
     """
 
+    existing = None
     try:
-        with open(filename, 'r') as file:
-            traj_list = eval(file.read())
-            trajectories = model.get_trajectories(traj_list)
-            file.close()
+        existing = json.load(open(filename, "r"))
+    except IOError:
+        print("No existing configuration found")
+
+    file = open(filename, "w")
+
+    try:
+        if existing is not None:
+            print(f"Found existing configuration file at {filename}")
+            print(f"Backing up to {filename}.bak")
+            backup = open(f"{filename}.bak", "w")
+            json.dump(existing, backup)
+            backup.close()
     except IOError:
-        raise ValueError("File for animals not found, please generate using option 6")
+        print("Could not write backup file")
+        exit(1)
+
+    config = get_config(model, data_file, hyperparams)
 
-    feature_matrix = model.get_feature_matrix()
+    json.dump(config, file)
+    file.close()
+
+
+def irl_rewards(model, filename, hyperparams, deep=False, resume=None):
+    """Do everything irl_vultures does
+    Progress is checkpointed every "checkpoint every" iterations. If resume
+    names a checkpoint, the run continues from it instead of starting over.
+    The checkpoint is deleted once the rewards are saved.
+    """
+
+    feature_matrix = feature_cache.get_feature_matrix(model)
     assert feature_matrix is not None
 
-    for traj in trajectories:
-        assert traj is not None
-    # Find the terminal points from the trajectories
-    terminals = list(map(lambda traj: traj[-1].next_state, trajectories))
-
-    # Create a giant empty grid for the gridworld
-    grid = [[0 for i in range(model.shape[0])] for j in range(model.shape[1])]
-    # Create the gridworld
-    print("Creating the GridWorld")
-    gw = gridworld.GridWorld(grid, terminals)
-    print("Getting Transition Probabilities")
-    # Get Transition Probabilities
-    P_a = gw.get_transition_mat()
+    trajectories, P_a = prepare_mdp(model, filename)
+    first_dim = model.shape[0]
+    last_dim = model.shape[1]
+    now = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    timestamp = now
+
+    deep_section = "_deep_" if deep else ""
+
+    # Checkpoints only resume runs with the same model, data and settings
+    config = config_hash({"config": get_config(model, filename, hyperparams),
+                          "deep": deep})
+    if resume is None:
+        checkpoint_file = (f"checkpoint_{first_dim}x{last_dim}"
+                           f"{deep_section}_{timestamp}.npz")
+    else:
+        checkpoint_file = resume
+    # a checkpoint every of 0 never checkpoints
+    checkpoint_every = hyperparams.get("checkpoint every", 5)
+    if checkpoint_every:
+        print(f"Checkpointing to {checkpoint_file}")
     # Create matrix for rewards
     start = time.time()
     learning_rate = hyperparams["learning rate"]
     gamma = hyperparams["discount factor"]
     iterations = hyperparams["iterations"]
+    planner = hyperparams.get("planner", "vi")
+    # a max horizon of 0 uses every step of every trajectory
+    max_horizon = hyperparams.get("max horizon", 0) or None
     if not deep:
         print("Running MaxEnt IRL")
+        # a tolerance of 0 never stops training early
+        grad_tol = hyperparams.get("gradient tolerance", 0) or None
+        ll_tol = hyperparams.get("likelihood tolerance", 0) or None
         rewards_maxent = maxent_irl.maxent_irl(feature_matrix, P_a, gamma,
                                                trajectories, learning_rate,
-                                               iterations)
+                                               iterations, planner=planner,
+                                               optimizer=hyperparams.get(
+                                                   "optimizer", "gd"),
+                                               grad_tol=grad_tol,
+                                               ll_tol=ll_tol,
+                                               max_horizon=max_horizon,
+                                               checkpoint_file=checkpoint_file,
+                                               checkpoint_every=checkpoint_every,
+                                               resume=resume is not None,
+                                               config=config)
     else:
         print("Running Deep MaxEnt IRL")
+        backend = hyperparams.get("deep backend", "numpy")
+        # the reward network only steps with gradient descent or adam
+        optimizer = hyperparams.get("optimizer", "gd")
+        if optimizer not in ["gd", "adam"]:
+            optimizer = "gd"
         rewards_maxent = deep_maxent_irl.deep_maxent_irl(feature_matrix, P_a,
                                                          gamma, trajectories,
                                                          learning_rate,
-                                                         iterations)
+                                                         iterations,
+                                                         planner=planner,
+                                                         max_horizon=max_horizon,
+                                                         backend=backend,
+                                                         optimizer=optimizer,
+                                                         checkpoint_file=checkpoint_file,
+                                                         checkpoint_every=checkpoint_every,
+                                                         resume=resume is not None,
+                                                         config=config)
+    end = time.time()
+    print("Time Elapsed: ", end - start)
+
+    save_file = f"rewards_{first_dim}x{last_dim}{deep_section}_{timestamp}"
+
+    np.save(save_file, rewards_maxent)
+    # The rewards are saved, so the run has nothing left to resume
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return (save_file + ".npy")
+
+
+def bootstrap_rewards(model, filename, hyperparams):
+    """Fits "bootstrap samples" reward maps to birds resampled with
+    replacement, in parallel. Saves the per state mean and standard
+    deviation maps and returns their filenames
+    """
+
+    feature_matrix = feature_cache.get_feature_matrix(model)
+    assert feature_matrix is not None
+
+    trajectories, P_a = prepare_mdp(model, filename)
+    start = time.time()
+    n_boot = hyperparams.get("bootstrap samples", 50)
+    print(f"Running {n_boot} bootstrap MaxEnt IRL fits")
+    # the fits step together with plain or adam gradient steps
+    optimizer = hyperparams.get("optimizer", "gd")
+    if optimizer not in ["gd", "adam"]:
+        optimizer = "gd"
+    mean, std, _ = bootstrap_irl.bootstrap_maxent_irl(
+        feature_matrix, P_a, hyperparams["discount factor"], trajectories,
+        hyperparams["learning rate"], hyperparams["iterations"],
+        n_boot=n_boot, optimizer=optimizer,
+        max_horizon=hyperparams.get("max horizon", 0) or None)
     end = time.time()
     print("Time Elapsed: ", end - start)
 
     first_dim = model.shape[0]
     last_dim = model.shape[1]
-    now = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    timestamp = now
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
-    deep_section = "_deep_" if deep else ""
+    mean_file = f"rewards_{first_dim}x{last_dim}_bootmean_{timestamp}"
+    std_file = f"rewards_{first_dim}x{last_dim}_bootstd_{timestamp}"
+    np.save(mean_file, mean)
+    np.save(std_file, std)
+    return (mean_file + ".npy"), (std_file + ".npy")
 
-    save_file = f"rewards_{first_dim}x{last_dim}{deep_section}_{timestamp}"
 
-    np.save(save_file, rewards_maxent)
-    return (save_file + ".npy")
+def feature_heatmap(model, whole_map=False):
+    """Colors every pixel of the model's region (or of the whole map) by
+    its combination of feature buckets. Saves the map of combination ids,
+    scaled to (0, 1], and returns its filename
+    """
+
+    region = model
+    if whole_map:
+        height, width = list(model.feature_dict.values())[0].data.shape
+        region = mod.Model(0, width - 1, 0, height - 1)
+        region.feature_dict = model.feature_dict
+
+    features = feature_cache.get_feature_matrix(region)
+    _, first, inverse = np.unique(features, axis=0, return_index=True,
+                                  return_inverse=True)
+    # number the combinations from 1 in the order they first appear,
+    # column by column, as the per pixel loop used to
+    ids = np.empty(len(first), dtype=np.int64)
+    ids[np.argsort(first)] = np.arange(1, len(first) + 1)
+    map = np.reshape(ids[np.ravel(inverse)], region.shape,
+                     order="F").astype(np.float32)
+    print(f"Found {len(first)} feature combinations")
+
+    normal = np.divide(map, np.max(map))
+    whole_section = "_whole" if whole_map else ""
+    filename = f"Feature_{region.shape[1]}x{region.shape[0]}_colors{whole_section}"
+    np.save(filename, normal)
+    return filename + ".npy"
 
 
 # Start The CLI
@@ -179,11 +307,35 @@ except IOError:
     model = mod.Model()
     hyperparams = {"learning rate": 0.02,
                    "discount factor": 0.8,
-                   "iterations": 20}
+                   "iterations": 20,
+                   "planner": "vi",
+                   "optimizer": "gd",
+                   "gradient tolerance": 0,
+                   "likelihood tolerance": 0,
+                   "max horizon": 0,
+                   "deep backend": "numpy",
+                   "checkpoint every": 5,
+                   "bootstrap samples": 50}
     data_file = None
 
 rewards_file = None
 
+if args.resume is not None:
+    # Deep checkpoints store the network weights instead of theta
+    with np.load(args.resume) as checkpoint:
+        resume_deep = "weight_0" in checkpoint.files
+    rewards_file = irl_rewards(model, data_file, hyperparams,
+                               deep=resume_deep, resume=args.resume)
+    print(f"Rewards saved to {rewards_file}")
+
+if args.sweep is not None:
+    with open(args.sweep, "r") as file:
+        grid = json.load(file)
+    results_file = run_sweep(model, data_file, hyperparams, grid,
+                             processes=args.processes)
+    print(f"Sweep results saved to {results_file}")
+    quit()
+
 print("Welcome to the Animal Tracking CLI!")
 options = {1:   'Load Features',
            2:   'Generate Reward Map',
@@ -212,7 +364,8 @@ while True:
         # load features
         feature_opts = {1: "Load a new feature",
                         2: "Remove an existing feature",
-                        3: "Change a bin number"}
+                        3: "Change a bin number",
+                        4: "Change a bucket scheme"}
 
         for i, feature_option in zip(feature_opts.keys(),
                                      feature_opts.values()):
@@ -229,9 +382,14 @@ while True:
         if feature_option == 1:
             # load feature
             name = input("Feature name: ")
-            filename = input("Enter npy filename: ")
+            filename = input("Enter npy or raster stack filename: ")
             bins = input("How many bins for the feature: ")
-            feature = mod.Feature(name, bins, file=filename)
+            if filename.endswith(".npy"):
+                feature = mod.Feature(name, bins, file=filename)
+            else:
+                layer = input(f"Layer of {filename} (default {name}): ")
+                feature = mod.Feature(name, bins, file=layer or None,
+                                      stack=filename)
             model.feature_dict[name] = feature
         elif feature_option == 2:
             # remove feature
@@ -259,11 +417,32 @@ while True:
                     print("Option was not an int")
                     continue
             model.feature_dict[to_change].buckets = bins
+        elif feature_option == 4:
+            # change bucket scheme
+            for feature in model.feature_dict.keys():
+                obj = model.feature_dict[feature]
+                print(f"{feature}: {obj} ({obj.scheme})")
+            to_change = None
+            while to_change not in model.feature_dict.keys():
+                to_change = input("Enter name of feature to change: ")
+            print(f"Schemes: {', '.join(mod.BUCKET_SCHEMES)}")
+            scheme = input("Enter bucket scheme: ")
+            edges = None
+            try:
+                if scheme == "edges":
+                    edges = [float(edge) for edge in input(
+                        "Enter the inner bucket edges, comma separated: "
+                    ).split(",")]
+                model.feature_dict[to_change].set_scheme(scheme, edges)
+            except ValueError as e:
+                print(e)
+                continue
 
     elif option == 2:
         # generate the reward map
         reward_opts = {1: "MaxEnt IRL",
-                       2: "Deep MaxEnt IRL"}
+                       2: "Deep MaxEnt IRL",
+                       3: "Bootstrap MaxEnt IRL (mean and std maps)"}
 
         for i, reward_option in zip(reward_opts.keys(),
                                     reward_opts.values()):
@@ -284,12 +463,18 @@ while True:
             rewards_file = irl_rewards(model, data_file, hyperparams,
                                        deep=True)
             print(f"Rewards file generated at {rewards_file}")
+        elif reward_option == 3:
+            rewards_file, std_file = bootstrap_rewards(model, data_file,
+                                                       hyperparams)
+            print(f"Mean rewards file generated at {rewards_file}")
+            print(f"Standard deviation file generated at {std_file}")
     elif option == 3:
         # display the reward map
         plot_file = rewards_file
         reward_options = {1: "Display reward map from current session",
                           2: "Display previous reward map",
-                          3: "Feature Heatmap"}
+                          3: "Feature Heatmap",
+                          4: "Feature Heatmap of the whole map"}
         for reward_option, reward_option_index in zip(reward_options.values(),
                                                       reward_options.keys()):
             print(f'{reward_option_index}: {reward_option}')
@@ -301,32 +486,9 @@ while True:
                 print("Option was not an int")
                 continue
 
-        if reward_option == 3:
-            shape = model.shape
-            map = np.zeros(model.shape, dtype=np.float32)
-            comb_dict = {}
-            for x in range(model.shape[1]):
-                for y in range(model.shape[0]):
-                    comb = tuple(
-                        [feature.get_bucket(
-                            feature.get_value(x + model.x_start,
-                                              y + model.y_start)
-                        ) for feature in model.feature_dict.values()])
-                    print(comb)
-                    if comb in comb_dict.keys():
-                        comb_val = comb_dict[comb]
-                    else:
-                        if len(comb_dict.values()) > 0:
-                            comb_val = max(comb_dict.values()) + 1
-                        else:
-                            comb_val = 1
-                        comb_dict[comb] = comb_val
-                    map[y, x] = comb_dict[comb]
-
-            normal = np.divide(map, np.max(map))
-            filename = f"Feature_{model.shape[1]}x{model.shape[0]}_colors"
-            np.save(filename, normal)
-            draw_plot(filename + ".npy")
+        if reward_option in [3, 4]:
+            filename = feature_heatmap(model, whole_map=reward_option == 4)
+            draw_plot(filename)
 
             continue
 
@@ -362,8 +524,27 @@ while True:
         while to_change not in hyperparams.keys():
             to_change = input("Enter name of hyperparameter to change: ")
         try:
-            if to_change == "iterations":
+            if to_change in ["iterations", "max horizon", "checkpoint every",
+                             "bootstrap samples"]:
                 new_value = int(input("What is the new desired value: "))
+            elif to_change == "planner":
+                print(f"Planners: {', '.join(PLANNERS.keys())}")
+                new_value = input("What is the new desired value: ")
+                if new_value not in PLANNERS:
+                    print("Unknown planner")
+                    continue
+            elif to_change == "deep backend":
+                print(f"Backends: {', '.join(deep_maxent_irl.BACKENDS)}")
+                new_value = input("What is the new desired value: ")
+                if new_value not in deep_maxent_irl.BACKENDS:
+                    print("Unknown backend")
+                    continue
+            elif to_change == "optimizer":
+                print(f"Optimizers: {', '.join(OPTIMIZERS.keys())}")
+                new_value = input("What is the new desired value: ")
+                if new_value not in OPTIMIZERS:
+                    print("Unknown optimizer")
+                    continue
             else:
                 new_value = float(input("What is the new desired value: "))
         except TypeError: